@@ -15,26 +15,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import os
 import sys
 
 from argparse import ArgumentParser
-from msm import MycroftSkillsManager, SkillRepo
-
-from msk.actions.create import CreateAction
-from msk.actions.create_test import CreateTestAction
-from msk.actions.submit import SubmitAction
-from msk.exceptions import MskException
-from msk.global_context import GlobalContext
-from msk.util import ensure_git_user
+from importlib import import_module
 
+# Actions are referenced by module path so that only the chosen action (and
+# the libraries it depends on) is imported. Import time budget on top of
+# interpreter startup, measured with python -X importtime:
+#   msk --help           < 10ms   (argparse only)
+#   msk create-test      < 20ms   (no GitPython, PyGithub or msm)
+#   msk create / submit  ~300ms   (GitPython, PyGithub, msm, requests)
 action_names = {
-    SubmitAction: ["submit", "update", "upgrade", "upload"],
-    CreateAction: ["create"],
-    CreateTestAction: ["create-test"],
+    "msk.actions.submit:SubmitAction": [
+        "submit", "update", "upgrade", "upload"
+    ],
+    "msk.actions.create:CreateAction": ["create"],
+    "msk.actions.create_test:CreateTestAction": ["create-test"],
+    "msk.actions.stats:StatsAction": ["stats"],
 }
 
 
-def main():
+def load_action(path: str):
+    """Import an action class from its "module:Class" path"""
+    module_name, cls_name = path.split(":")
+    return getattr(import_module(module_name), cls_name)
+
+
+def find_action_path(argv: list):
+    """Find the action path of the first subcommand given on the command
+    line without importing any of the actions"""
+    name_to_path = {
+        name: path for path, names in action_names.items() for name in names
+    }
+    for arg in argv:
+        if arg in name_to_path:
+            return name_to_path[arg]
+    return None
+
+
+def create_parser() -> ArgumentParser:
     parser = ArgumentParser()
     parser.add_argument("-l", "--lang", default="en-us")
     parser.add_argument(
@@ -46,33 +67,121 @@ def main():
     parser.add_argument(
         "-s", "--skills-dir", help="Directory to look for skills in"
     )
+    parser.add_argument(
+        "-p",
+        "--partial-clone",
+        action="store_true",
+        default=bool(os.environ.get("MSK_PARTIAL_CLONE")),
+        help="Use a shallow, sparse clone of the skills repo (ie. for CI)",
+    )
+    parser.add_argument(
+        "--no-clone",
+        action="store_true",
+        default=bool(os.environ.get("MSK_NO_CLONE")),
+        help="Create skills repo commits through the GitHub API instead "
+        "of a local clone",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write a Chrome/Perfetto trace of git, GitHub and prompt time",
+    )
+    return parser
+
+
+def parse_action(parser: ArgumentParser, argv: list):
+    """Parse the command line, registering the arguments of the selected
+    action only. Returns the action class, its name and the arguments."""
+    selected_path = find_action_path(argv)
 
     subparsers = parser.add_subparsers(dest="action")
     subparsers.required = True
-    action_to_cls = {}
-    for cls, names in action_names.items():
-        cls.register(subparsers.add_parser(names[0], aliases=names[1:]))
-        action_to_cls.update({name: cls for name in names})
+    action_to_path = {}
+    selected_cls = None
+    for path, names in action_names.items():
+        subparser = subparsers.add_parser(names[0], aliases=names[1:])
+        if path == selected_path:
+            selected_cls = load_action(path)
+            selected_cls.register(subparser)
+        action_to_path.update({name: path for name in names})
+
+    args = parser.parse_args(argv)
+    action_path = action_to_path[args.action]
+    cls = selected_cls or load_action(action_path)
+    return cls, action_names[action_path][0], args
 
-    args = parser.parse_args(sys.argv[1:])
 
-    ensure_git_user()
+def start_recording(cls, action_name: str, args):
+    """Start the trace and stats the flags and action ask for, returning
+    the RunStats if any"""
+    from msk.trace import instrument_git, start_tracing
+
+    if "github" in cls.requires:
+        from msk import rate_limit
+
+        rate_limit.command = action_name
+    if args.trace:
+        start_tracing()
+    if not cls.record_stats:
+        return None
+    from msk.stats import RunStats
+
+    stats = RunStats(action_name)
+    stats.start()
+    if cls.requires:
+        instrument_git()
+    return stats
+
+
+def report_error(e: Exception) -> bool:
+    """Print an error msk expects, returns False for any other"""
+    # Imported here since msk.exceptions depends on msm
+    from github import BadCredentialsException
+    from msk.exceptions import MskException
+    from msk.util import revalidate_github_token
+
+    if isinstance(e, BadCredentialsException):
+        print("GitHub rejected the Personal Access Token.")
+        if revalidate_github_token():
+            print("The stored token is still valid, please retry.")
+        else:
+            print("The stored token was removed, please rerun msk.")
+    elif isinstance(e, MskException):
+        print("{}: {}".format(e.__class__.__name__, str(e)))
+    else:
+        return False
+    return True
+
+
+def main():
+    cls, action_name, args = parse_action(create_parser(), sys.argv[1:])
+
+    from msk.global_context import GlobalContext
+    from msk.trace import span, stop_tracing
+
     context = GlobalContext()
     context.lang = args.lang
-    context.msm = MycroftSkillsManager(
-        skills_dir=args.skills_dir,
-        repo=SkillRepo(
-            url=args.repo_url, branch=args.repo_branch
-        ),
-    )
-    context.branch = context.msm.repo.branch
+    context.skills_dir = args.skills_dir
+    context.skills_repo_url = args.repo_url
+    context.skills_repo_branch = args.repo_branch
+    context.partial_clone = args.partial_clone
+    context.clone_free = args.no_clone
 
+    stats = start_recording(cls, action_name, args)
     try:
-        return action_to_cls[args.action](args).perform()
-    except MskException as e:
-        print("{}: {}".format(e.__class__.__name__, str(e)))
+        with span("msk " + action_name, "action"):
+            context.prepare(*cls.requires)
+            return cls(args).perform()
     except (KeyboardInterrupt, EOFError):
         pass
+    except Exception as e:
+        if not report_error(e):
+            raise
+    finally:
+        if args.trace:
+            stop_tracing(args.trace)
+        if stats:
+            stats.stop()
 
 
 if __name__ == "__main__":
@@ -34,6 +34,7 @@ from colorama import Style, Fore, init as colorama_init
 from msk.console_action import ConsoleAction
 from msk.exceptions import GithubRepoExists, UnrelatedGithubHistory
 from msk.lazy import Lazy
+from msk.trace import span
 from msk.util import (
     ask_input,
     to_camel,
@@ -157,6 +158,8 @@ def pretty_license(path):
 
 
 class CreateAction(ConsoleAction):
+    requires = ("git_user", "msm")
+
     def __init__(self, args, name: str = None):
         colorama_init()
         if name:
@@ -168,7 +171,7 @@ class CreateAction(ConsoleAction):
 
     @Lazy
     def name(self) -> str:
-        name_to_skill = {skill.name: skill for skill in self.msm.list()}
+        name_to_skill = self.skills.by_name
         while True:
             name = (
                 ask_input(
@@ -547,10 +550,11 @@ class CreateAction(ConsoleAction):
                         raise GithubRepoExists(repo_name) from e
                     raise
                 self.git.remote("add", "origin", repo.html_url)
-                call(
-                    ["git", "push", "-u", "origin", "master"],
-                    cwd=self.git.working_dir,
-                )
+                with span("git push", "git", branch="master"):
+                    call(
+                        ["git", "push", "-u", "origin", "master"],
+                        cwd=self.git.working_dir,
+                    )
                 print("Created GitHub repo:", repo.html_url)
                 return repo
         return None
@@ -27,7 +27,6 @@ from random import shuffle
 from typing import Dict
 
 from msk.console_action import ConsoleAction
-from msk.exceptions import MskException
 from msk.global_context import GlobalContext
 from msk.lazy import Lazy
 from msk.util import (
@@ -346,6 +345,8 @@ class CreateTestAction(ConsoleAction):
 
     def perform(self):
         if not isdir(self.folder):
+            from msk.exceptions import MskException
+
             raise MskException(
                 "Skill folder at {} does not exist".format(self.folder)
             )
@@ -0,0 +1,98 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from argparse import ArgumentParser
+
+from msk.console_action import ConsoleAction
+from msk.stats import (
+    collect_samples,
+    load_runs,
+    percentile,
+    quantiles,
+    statsfile,
+    to_openmetrics,
+)
+
+titles = {
+    "duration": "Action duration (s)",
+    "phase": "Phase duration (s)",
+    "git": "Git commands",
+    "github": "GitHub requests",
+}
+
+
+class StatsAction(ConsoleAction):
+    record_stats = False
+
+    def __init__(self, args):
+        self.action = args.action_filter
+        self.openmetrics = args.openmetrics
+
+    @staticmethod
+    def register(parser: ArgumentParser):
+        parser.add_argument(
+            "-a",
+            "--action",
+            dest="action_filter",
+            help="Only include runs of this action",
+        )
+        parser.add_argument(
+            "--openmetrics",
+            action="store_true",
+            help="Print the statistics in OpenMetrics text format",
+        )
+
+    def perform(self):
+        runs = [
+            run
+            for run in load_runs()
+            if not self.action or run["action"] == self.action
+        ]
+        samples = collect_samples(runs)
+        if self.openmetrics:
+            print(to_openmetrics(samples))
+            return
+        if not runs:
+            print("No runs recorded yet in", statsfile)
+            return
+
+        print("Statistics of {} runs from {}".format(len(runs), statsfile))
+        for metric, by_label in samples.items():
+            if not by_label:
+                continue
+            print()
+            print(
+                "{:<30} {:>6} {}".format(
+                    titles[metric],
+                    "count",
+                    " ".join(
+                        "{:>9}".format("p{}".format(int(q * 100)))
+                        for q in quantiles
+                    ),
+                )
+            )
+            for label, values in sorted(by_label.items()):
+                print(
+                    "{:<30} {:>6} {}".format(
+                        label,
+                        len(values),
+                        " ".join(
+                            "{:>9.3f}".format(percentile(values, q))
+                            for q in quantiles
+                        ),
+                    )
+                )
@@ -24,7 +24,10 @@ from msk.exceptions import NotUploaded
 
 
 class SubmitAction(ConsoleAction):
+    requires = ("git_user", "github")
+
     def __init__(self, args):
+        # Updates the skills repo once, which the upload reuses
         try:
             self.action = UpgradeAction(args)
         except NotUploaded:
@@ -16,15 +16,17 @@
 # limitations under the License.
 #
 from argparse import ArgumentParser
-from genericpath import samefile
+from os.path import abspath, expanduser
+
 from git import Git
-from github.Repository import Repository
-from msm import MycroftSkillsManager
+from msm import SkillEntry
 
 from msk.console_action import ConsoleAction
 from msk.exceptions import NotUploaded
+from msk.github_graphql import presubmit_lookup
+from msk.lazy import prefetch
 from msk.repo_action import SkillData
-from msk.util import skills_kit_footer, create_or_edit_pr
+from msk.util import skills_kit_footer, create_or_edit_pr, skill_repo_name
 
 body_template = (
     """
@@ -36,58 +38,83 @@ This upgrades {skill_name} to include the following new commits:
     + skills_kit_footer
 )
 
+# Commits listed in the PR body before the rest are only counted
+max_listed_commits = 50
+
 
 class UpgradeAction(ConsoleAction):
     def __init__(self, args):
-        msm = MycroftSkillsManager()
-        skill_matches = [
-            skill
-            for skill in msm.list()
-            if skill.is_local and samefile(skill.path, args.skill_folder)
-        ]
-        if not skill_matches:
+        folder = abspath(expanduser(args.skill_folder))
+        skill = SkillEntry.from_folder(folder)
+        if not skill.url:
             raise NotUploaded(
-                "Skill at folder not uploaded to store: "
-                f"{args.skill_folder}"
+                f"Skill at folder has no git remote: {args.skill_folder}"
             )
-
-        self.skill = SkillData(skill_matches[0])
-        self.skill.init_existing()  # Verifies the skill exists
+        # The submodule is found by the url of the skill, its name is the
+        # one used in the skills repo
+        self.skill = SkillData(skill)
+        if self.clone_free:
+            skill.name = self.skill.remote_submodule["name"]
+        else:
+            skill.name = self.skill.submodule.name
 
     @staticmethod
     def register(parser: ArgumentParser):
         pass  # Implemented in SubmitAction
 
-    def create_pr_message(
-        self, skill_git: Git, skill_repo: Repository
-    ) -> tuple:
+    def create_pr_message(self, skill_git: Git, repo_url: str) -> tuple:
         """Create a list of changes for PR content from git commits."""
+        repo_url = "https://github.com/" + skill_repo_name(repo_url)
+        commits = [
+            line.split(" ", 1)
+            for line in skill_git.log(
+                "--ancestry-path",
+                "--format=%H %s",
+                "{}..{}".format(self.skill.entry.sha, "HEAD"),
+            ).split("\n")
+            if line
+        ]
+        lines = [
+            " - [{}]({}/commit/{})".format(subject, repo_url, sha)
+            for sha, subject in commits[:max_listed_commits]
+        ]
+        if len(commits) > max_listed_commits:
+            lines.append(
+                " - ...and [{} more]({}/compare/{}...{})".format(
+                    len(commits) - max_listed_commits,
+                    repo_url,
+                    self.skill.entry.sha,
+                    commits[0][0],
+                )
+            )
         title = "Upgrade " + self.skill.name
         body = body_template.format(
-            skill_name=self.skill.name,
-            commits="\n".join(
-                " - [{}]({})".format(
-                    skill_git.show("-s", sha, format="%s"),
-                    skill_repo.get_commit(sha).html_url,
-                )
-                for sha in skill_git.rev_list(
-                    "--ancestry-path",
-                    "{}..{}".format(self.skill.entry.sha, "HEAD"),
-                ).split("\n")
-            ),
+            skill_name=self.skill.name, commits="\n".join(lines)
         )
         return title, body
 
     def perform(self):
         print("Upgrading an existing skill in the skill repo...")
-        upgrade_branch = self.skill.upgrade()
-        self.repo.push_to_fork(upgrade_branch)
-        title, body = self.create_pr_message(self.skill.git, self.skill.hub)
+        if not presubmit_lookup(self, branch=self.skill.upgrade_branch):
+            prefetch(self, "login", "repo.hub", "repo.fork_name")
+        with self.repo.branch_lock(self.skill.upgrade_branch):
+            upgrade_branch = self.skill.upgrade()
+            if not self.clone_free:
+                self.repo.push_to_fork(upgrade_branch)
+        title, body = self.create_pr_message(
+            self.skill.git, self.skill.entry.url
+        )
         print()
         print("===", title, "===")
         print(body)
         print()
         pull = create_or_edit_pr(
-            title, body, self.repo.hub, self.user, upgrade_branch, self.branch
+            title,
+            body,
+            self.repo.hub,
+            self.login,
+            upgrade_branch,
+            self.branch,
+            self.repo.open_pulls.get(upgrade_branch),
         )
         print("Created PR at:", pull.html_url)
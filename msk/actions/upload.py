@@ -15,13 +15,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import os
 import shutil
 from os import listdir
 from argparse import ArgumentParser
 from os.path import join, abspath, expanduser, basename
 
 from git import Git, GitCommandError
+from github.Repository import Repository
 from msm import SkillEntry
 
 from msk.actions.create import CreateAction
@@ -32,7 +32,9 @@ from msk.exceptions import (
     UnrelatedGithubHistory,
     GithubRepoExists,
 )
-from msk.lazy import Lazy
+from msk.git_objects import list_tree
+from msk.github_graphql import presubmit_lookup
+from msk.lazy import InstanceLazy, Lazy, prefetch
 from msk.repo_action import SkillData
 from msk.util import (
     skills_kit_footer,
@@ -40,6 +42,7 @@ from msk.util import (
     ask_yes_no,
     skill_repo_name,
     read_file,
+    MarkdownSections,
 )
 
 body_template = (
@@ -57,32 +60,68 @@ This PR adds the new skill, [{skill_name}]({skill_url}), to the skills repo.
 )
 
 
-def exists_in_remote(git, repo_path):
-    """Checks if the file at repo_path exists in remote HEAD."""
+# Files the remote repo must contain, as (alternative names, message if
+# none of them exist)
+required_files = [
+    (
+        ("LICENSE.md", "LICENSE", "LICENSE.txt"),
+        "To have your Skill available for installation through the "
+        "Skills Marketplace, a license is required.\n"
+        "Please select one and add it to the skill as "
+        "`LICENSE.md.`\n"
+        "See https://opensource.org/licenses for information on "
+        "open source license options.",
+    ),
+    (
+        ("README.md",),
+        "For inclusion in the Mycroft Marketplace a README.md file "
+        "is required. please add the file and retry.",
+    ),
+]
+
+
+def list_remote_files(git) -> set:
+    """List the files at the root of the remote HEAD tree.
+
+    Uses one ls-remote to find the branch HEAD points to and reads the tree
+    of its tracking branch through the persistent cat-file process.
+    """
     try:
-        remote_info = git.remote("show", "origin").split("\n")
-        heads = [e.split(":")[1].strip() for e in remote_info if "HEAD" in e]
-        remote_file = "origin/{}:{}".format(heads[0], repo_path)
-        git.cat_file(remote_file, e=True)
-    except GitCommandError:
-        return False
-    else:
-        return True
+        head_info = git.ls_remote("--symref", "origin", "HEAD").split("\n")
+        heads = [
+            line.split("\t")[0].split("refs/heads/")[1]
+            for line in head_info
+            if line.startswith("ref:")
+        ]
+        return {
+            entry.name for entry in list_tree(git, "origin/" + heads[0])
+        }
+    except (GitCommandError, IndexError):
+        return set()
 
 
 class UploadAction(ConsoleAction):
     def __init__(self, args):
         folder = abspath(expanduser(args.skill_folder))
         self.entry = SkillEntry.from_folder(folder)
-        skills_dir = abspath(expanduser(self.msm.skills_dir))
+        skills_dir = abspath(expanduser(self.skills_folder))
         if join(skills_dir, basename(folder)) != folder:
             raise MskException(
                 f"Skill folder, {args.skill_folder}, not directly within "
-                f"skills directory, {self.msm.skills_dir}."
+                f"skills directory, {self.skills_folder}."
             )
         self.skill_dir = folder
 
     git = Lazy(lambda s: Git(s.entry.path))  # type: Git
+    remote_files = InstanceLazy(
+        lambda s: list_remote_files(s.git)
+    )  # type: set
+    readme = InstanceLazy(
+        lambda s: MarkdownSections(read_file(s.entry.path, "README.md"))
+    )  # type: MarkdownSections
+    skill_repo = InstanceLazy(
+        lambda s: s.github.get_repo(skill_repo_name(s.entry.url))
+    )  # type: Repository
 
     @staticmethod
     def register(parser: ArgumentParser):
@@ -91,41 +130,20 @@ class UploadAction(ConsoleAction):
     def check_valid(self):
         """Check the skill contains all required files before uploading."""
         results = []
-        if not (
-            exists_in_remote(self.git, "LICENSE.md")
-            or exists_in_remote(self.git, "LICENSE")
-            or exists_in_remote(self.git, "LICENSE.txt")
-        ):
-            print(
-                "To have your Skill available for installation through the "
-                "Skills Marketplace, a license is required.\n"
-                "Please select one and add it to the skill as "
-                "`LICENSE.md.`\n"
-                "See https://opensource.org/licenses for information on "
-                "open source license options."
-            )
-            results.append(False)
-        else:
-            results.append(True)
-
-        if not exists_in_remote(self.git, "README.md"):
-            print(
-                "For inclusion in the Mycroft Marketplace a README.md file "
-                "is required. please add the file and retry."
-            )
-            results.append(False)
-        else:
-            results.append(True)
+        for names, message in required_files:
+            if self.remote_files.isdisjoint(names):
+                print(message)
+                results.append(False)
+            else:
+                results.append(True)
 
-        with open(join(self.skill_dir, "README.md")) as f:
-            readme = f.read()
-        if "# About" not in readme and "# Description" not in readme:
+        if "about" not in self.readme and "description" not in self.readme:
             print("README is missing About Section needed by the Marketplace")
             results.append(False)
         else:
             results.append(True)
 
-        if "# Category" not in readme:
+        if "category" not in self.readme:
             print(
                 "README is missing Category section needed by the "
                 "Marketplace"
@@ -137,6 +155,8 @@ class UploadAction(ConsoleAction):
 
     def perform(self):
         print("Uploading a new skill to the skill repo...")
+        if not presubmit_lookup(self, skill_url=self.entry.url):
+            prefetch(self, "login", "repo.hub", "repo.fork_name")
 
         for i in listdir(self.entry.path):
             if i.lower() == "readme.md" and i != "README.md":
@@ -168,11 +188,11 @@ class UploadAction(ConsoleAction):
                 )
         if skill_repo:
             self.entry.url = skill_repo.html_url
-            self.entry.author = self.user.login
+            self.entry.author = self.login
         else:
             if not self.entry.url:
                 raise NoGitRepository
-            skill_repo = self.github.get_repo(skill_repo_name(self.entry.url))
+            skill_repo = self.skill_repo
 
         if not skill_repo.permissions.push:
             print(
@@ -195,29 +215,16 @@ class UploadAction(ConsoleAction):
             "Enter a unique skill name (ie. npr-news or grocery-list): "
         )
 
-        readme_file = {i.lower(): i for i in os.listdir(self.entry.path)}[
-            "readme.md"
-        ]
-        readme = read_file(self.entry.path, readme_file)
-
-        last_section = None
-        sections = {last_section: ""}
-        for line in readme.split("\n"):
-            line = line.strip()
-            if line.startswith("#"):
-                last_section = line.strip("# ").lower()
-                sections[last_section] = ""
-            else:
-                sections[last_section] += "\n" + line
-        del sections[None]
-
-        if "about" in sections:
-            description = sections["about"]
-        elif "description" in sections:
-            description = sections["description"]
+        if "about" in self.readme:
+            description = self.readme["about"]
+        elif "description" in self.readme:
+            description = self.readme["description"]
 
-        branch = SkillData(self.entry).add_to_repo()
-        self.repo.push_to_fork(branch)
+        skill = SkillData(self.entry)
+        with self.repo.branch_lock(skill.add_branch):
+            branch = skill.add_to_repo()
+            if not self.clone_free:
+                self.repo.push_to_fork(branch)
 
         pull = create_or_edit_pr(
             title=f"Add {self.entry.name}",
@@ -226,7 +233,7 @@ class UploadAction(ConsoleAction):
                 skill_name=self.entry.name,
                 skill_url=skill_repo.html_url,
             ),
-            user=self.user,
+            login=self.login,
             branch=branch,
             skills_repo=self.repo.hub,
             repo_branch=self.branch,
@@ -17,13 +17,32 @@
 #
 from abc import ABCMeta, abstractmethod
 from argparse import ArgumentParser
+from typing import TYPE_CHECKING
 
 from msk.global_context import GlobalContext
 from msk.lazy import Lazy
-from msk.repo_action import RepoData
+
+if TYPE_CHECKING:
+    from msk.repo_action import RepoData
+
+
+def create_repo_data():
+    """Import RepoData (and with it GitPython) only once it is needed"""
+    from msk.repo_action import SkillData
+
+    # Shared with the skills so lookups done by the action are reused
+    return SkillData.repo
 
 
 class ConsoleAction(GlobalContext, metaclass=ABCMeta):
+    # Parts of the GlobalContext built before the action is created.
+    # Any of "git_user", "skills_repo", "msm" and "github". Everything
+    # else is still available, but only built on first use.
+    requires = ()
+
+    # Whether the timings of the run are added to the msk stats
+    record_stats = True
+
     @staticmethod
     @abstractmethod
     def register(parser: ArgumentParser):
@@ -33,4 +52,4 @@ class ConsoleAction(GlobalContext, metaclass=ABCMeta):
     def perform(self):
         pass
 
-    repo = Lazy(lambda s: RepoData())  # type: RepoData
+    repo = Lazy(lambda s: create_repo_data())  # type: RepoData
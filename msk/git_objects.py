@@ -0,0 +1,136 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Object reads through git's persistent cat-file processes
+
+GitPython keeps a ``git cat-file --batch-check`` and a ``--batch`` process
+per Git wrapper once get_object_header or get_object_data are used. The
+helpers here answer existence checks, tree listings and blob reads through
+them, so repeated questions about a repo don't fork git again. Every
+wrapper used this way has its processes closed when msk exits.
+"""
+
+import atexit
+from collections import namedtuple
+from os.path import split
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from git import Git
+
+from msk.trace import span
+
+TreeEntry = namedtuple("TreeEntry", "mode type sha name")
+
+tree_entry_types = {b"40000": "tree", b"160000": "commit"}
+
+# The cat-file pipes answer one request at a time
+lock = Lock()
+open_wrappers = []  # type: List[Git]
+
+
+def decode(value) -> str:
+    # GitPython returns bytes or str depending on its version
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def track(git: Git) -> Git:
+    if git not in open_wrappers:
+        open_wrappers.append(git)
+    return git
+
+
+def object_info(git: Git, rev: str) -> Optional[Tuple[str, str, int]]:
+    """Get the (sha, type, size) of an object or None if it doesn't exist"""
+    with lock, span("cat-file " + rev, "git-object"):
+        try:
+            sha, kind, size = track(git).get_object_header(rev)
+        except ValueError:
+            return None
+        return decode(sha), decode(kind), size
+
+
+def object_exists(git: Git, rev: str) -> bool:
+    return object_info(git, rev) is not None
+
+
+def read_object(git: Git, rev: str) -> Optional[Tuple[str, bytes]]:
+    """Read the (type, data) of an object or None if it doesn't exist"""
+    with lock, span("cat-file " + rev, "git-object"):
+        try:
+            _, kind, _, data = track(git).get_object_data(rev)
+        except ValueError:
+            return None
+        return decode(kind), data
+
+
+def read_blob(git: Git, rev: str) -> Optional[str]:
+    """Read a file, ie. read_blob(git, 'HEAD:.gitmodules')"""
+    obj = read_object(git, rev)
+    if not obj or obj[0] != "blob":
+        return None
+    return obj[1].decode("utf-8", "replace")
+
+
+def parse_tree(data: bytes) -> List[TreeEntry]:
+    """Parse the binary entries of a tree object"""
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        null = data.index(b"\0", space)
+        mode = data[pos:space]
+        entries.append(
+            TreeEntry(
+                mode.decode(),
+                tree_entry_types.get(mode, "blob"),
+                data[null + 1:null + 21].hex(),
+                data[space + 1:null].decode("utf-8", "surrogateescape"),
+            )
+        )
+        pos = null + 21
+    return entries
+
+
+def list_tree(git: Git, rev: str, path: str = "") -> List[TreeEntry]:
+    """List a directory of a commit, empty if it doesn't exist"""
+    obj = read_object(git, "{}:{}".format(rev, path.strip("/")))
+    if not obj or obj[0] != "tree":
+        return []
+    return parse_tree(obj[1])
+
+
+def tree_entry(git: Git, rev: str, path: str) -> Optional[TreeEntry]:
+    """Find the entry of a path in a commit, including submodule commits"""
+    folder, name = split(path.strip("/"))
+    for entry in list_tree(git, rev, folder):
+        if entry.name == name:
+            return entry
+    return None
+
+
+@atexit.register
+def close_all():
+    """Let the cat-file processes exit by closing their input"""
+    with lock:
+        for git in open_wrappers:
+            for cmd in (git.cat_file_header, git.cat_file_all):
+                if cmd and cmd.proc:
+                    cmd.proc.stdin.close()
+                    cmd.proc.wait()
+            git.clear_cache()
+        open_wrappers.clear()
@@ -0,0 +1,258 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Persistent HTTP cache for GitHub API requests
+
+Responses to GET requests are stored on disk with their ETag and
+Last-Modified headers. Later runs send conditional requests for them, and a
+304 answer (which doesn't count against the rate limit) is served from
+disk. Endpoints that rarely change can skip the request entirely for a
+while, see endpoint_ttls.
+"""
+
+import json
+import os
+import re
+import time
+from hashlib import sha256
+from os.path import join
+from typing import Optional
+
+from github import Github
+from github.Requester import HTTPSRequestsConnectionClass
+from requests import Response
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from msk import rate_limit
+from msk.locking import atomic_write
+from msk.trace import span
+from msk.util import tokendir
+
+cache_dir = join(tokendir, "cache", "github")
+max_cache_size = int(os.environ.get("MSK_GITHUB_CACHE_SIZE", 20 * 1024**2))
+
+# Seconds a cached response is used without asking GitHub at all. Anything
+# not listed here is always revalidated with a conditional request.
+endpoint_ttls = [
+    (re.compile(r"^/repos/[^/]+/[^/]+/commits/[0-9a-f]{40}$"), 30 * 86400),
+    (re.compile(r"^/repos/[^/]+/[^/]+$"), 5 * 60),
+    (re.compile(r"^/repos/[^/]+/[^/]+/pulls$"), 0),
+]
+
+
+def endpoint_ttl(path: str) -> int:
+    for pattern, ttl in endpoint_ttls:
+        if pattern.match(path):
+            return ttl
+    return 0
+
+
+class ResponseCache:
+    """Size bounded LRU store of responses, one file per request"""
+
+    def __init__(self, folder: str = cache_dir, max_size: int = None):
+        self.folder = folder
+        self.max_size = max_cache_size if max_size is None else max_size
+
+    def key(self, request) -> str:
+        # GitHub varies responses on these headers
+        parts = [
+            request.url,
+            request.headers.get("Accept", ""),
+            request.headers.get("Authorization", ""),
+        ]
+        return sha256("\n".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        path = join(self.folder, key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # Mark as recently used
+        return entry
+
+    def put(self, key: str, entry: dict):
+        with atomic_write(join(self.folder, key)) as f:
+            json.dump(entry, f)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries above max_size"""
+        entries = []
+        for name in os.listdir(self.folder):
+            if "." in name:
+                continue  # Being written by atomic_write
+            try:
+                stat = os.stat(join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(join(self.folder, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def cached_response(request, entry: dict, headers=None) -> Response:
+    response = Response()
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    if headers:
+        # Keep the rate limit information of the revalidation
+        response.headers.update(headers)
+    response._content = entry["body"].encode()
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def span_name(request) -> str:
+    return "{} {}".format(request.method, request.path_url)
+
+
+class CachingAdapter(HTTPAdapter):
+    """Requests adapter answering GET requests from a ResponseCache
+
+    Every request sent to GitHub is reported as a "github" span, responses
+    served from disk as "github cache" spans. Without a cache requests are
+    passed through.
+    """
+
+    def __init__(self, cache: Optional[ResponseCache], **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        scheduler = rate_limit.scheduler
+        # The token is chosen first, cached responses are stored per token
+        if scheduler and scheduler.assign_token(request):
+            response = self.send_cached(request, **kwargs)
+            if response.status_code not in (401, 403, 404):
+                return response
+            # ie. a private repo the other token can't see
+            scheduler.restore_token(request)
+        return self.send_cached(request, **kwargs)
+
+    def send_cached(self, request, **kwargs):
+        # Left from an attempt with another token
+        request.headers.pop("If-None-Match", None)
+        request.headers.pop("If-Modified-Since", None)
+        if request.method != "GET" or self.cache is None:
+            return self.send_network(request, **kwargs)
+
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry:
+            path = request.path_url.split("?")[0]
+            if time.time() - entry["time"] < endpoint_ttl(path):
+                with span(span_name(request), "github cache"):
+                    return cached_response(request, entry)
+            cached_headers = CaseInsensitiveDict(entry["headers"])
+            if cached_headers.get("ETag"):
+                request.headers["If-None-Match"] = cached_headers["ETag"]
+            if cached_headers.get("Last-Modified"):
+                request.headers["If-Modified-Since"] = cached_headers[
+                    "Last-Modified"
+                ]
+
+        response = self.send_network(request, **kwargs)
+        if response.status_code == 304 and entry:
+            entry["time"] = time.time()
+            self.cache.put(key, entry)
+            return cached_response(request, entry, response.headers)
+
+        headers = response.headers
+        if response.status_code == 200 and (
+            "ETag" in headers or "Last-Modified" in headers
+        ):
+            self.cache.put(
+                key,
+                {
+                    "status": response.status_code,
+                    "headers": dict(headers),
+                    "body": response.text,
+                    "time": time.time(),
+                },
+            )
+        return response
+
+    def send_network(self, request, **kwargs):
+        """Send the request to GitHub, within the rate limits if scheduled"""
+        if rate_limit.scheduler:
+            return rate_limit.scheduler.send(
+                self.send_counted, request, **kwargs
+            )
+        return self.send_counted(request, **kwargs)
+
+    def send_counted(self, request, **kwargs):
+        with span(span_name(request), "github") as info:
+            response = super().send(request, **kwargs)
+            info["status"] = response.status_code
+            return response
+
+
+class CachingConnection(HTTPSRequestsConnectionClass):
+    """PyGithub connection that sends its requests through a CachingAdapter"""
+
+    cache = ResponseCache()
+
+    # Only network errors and server errors are retried here, the request
+    # scheduler handles 403 and 429 rate limit responses itself
+    network_retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+        respect_retry_after_header=False,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool_size = getattr(self, "pool_size", DEFAULT_POOLSIZE)
+        self.session.mount(
+            "https://",
+            CachingAdapter(
+                self.cache,
+                max_retries=self.network_retry,
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+            ),
+        )
+
+
+def enable_cache(github: Github) -> Github:
+    """Route the requests of a Github client through the on-disk cache
+
+    PyGithub has no public hook for this, so the connection class of this
+    client's requester is replaced. Clients using plain http or PyGithub
+    versions without it are left as is.
+    """
+    requester = getattr(github, "_Github__requester", None)
+    connection_cls = getattr(requester, "_Requester__connectionClass", None)
+    if connection_cls is HTTPSRequestsConnectionClass:
+        requester._Requester__connectionClass = CachingConnection
+    return github
@@ -0,0 +1,246 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Single GraphQL round trip for the GitHub lookups made before a submit
+
+Uploading or upgrading a skill needs the authenticated user, the skills
+repo, the user's fork of it, whether the user can push to the skill repo
+and any open PR of the branch. Over REST that is a request each;
+presubmit_lookup() asks for all of them at once and fills the Lazy
+attributes that would otherwise make those requests.
+"""
+
+from typing import TYPE_CHECKING, Optional
+
+from github import GithubException
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+
+from msk.trace import traced
+from msk.util import skill_repo_name
+
+if TYPE_CHECKING:
+    from github import Github
+    from msk.console_action import ConsoleAction
+
+# Open PRs are listed by branch name, so PRs of other users' branches of
+# the same name come along. Pages are fetched until the user's one is seen.
+pulls_fragment = """
+fragment PullPage on PullRequestConnection {
+  nodes {
+    number
+    body
+    url
+    headRepositoryOwner { login }
+  }
+  pageInfo { hasNextPage endCursor }
+}
+"""
+
+presubmit_query = """
+query Presubmit(
+  $owner: String!, $name: String!,
+  $skillOwner: String!, $skillName: String!, $withSkill: Boolean!,
+  $branch: String!, $base: String!, $withPulls: Boolean!
+) {
+  viewer {
+    login
+    fork: repository(name: $name) {
+      nameWithOwner
+      isFork
+      parent { nameWithOwner }
+    }
+  }
+  skills: repository(owner: $owner, name: $name) {
+    nameWithOwner
+    pullRequests(
+      headRefName: $branch, baseRefName: $base, states: OPEN, first: 100
+    ) @include(if: $withPulls) {
+      ...PullPage
+    }
+  }
+  skill: repository(owner: $skillOwner, name: $skillName)
+      @include(if: $withSkill) {
+    nameWithOwner
+    url
+    viewerPermission
+  }
+}
+""" + pulls_fragment
+
+pulls_query = """
+query OpenPulls(
+  $owner: String!, $name: String!,
+  $branch: String!, $base: String!, $after: String!
+) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(
+      headRefName: $branch, baseRefName: $base, states: OPEN, first: 100,
+      after: $after
+    ) {
+      ...PullPage
+    }
+  }
+}
+""" + pulls_fragment
+
+push_permissions = {"ADMIN", "MAINTAIN", "WRITE"}
+
+
+def repository(github: "Github", full_name: str, **data) -> Repository:
+    """Repository object from known data, without a request"""
+    owner, name = full_name.split("/")
+    return github.create_from_raw_data(
+        Repository,
+        dict(
+            data,
+            full_name=full_name,
+            name=name,
+            owner={"login": owner},
+            url="{}/repos/{}".format(github.requester.base_url, full_name),
+        ),
+    )
+
+
+def pull_request(github: "Github", full_name: str, node: dict) -> PullRequest:
+    return github.create_from_raw_data(
+        PullRequest,
+        {
+            "number": node["number"],
+            "body": node["body"],
+            "html_url": node["url"],
+            "url": "{}/repos/{}/pulls/{}".format(
+                github.requester.base_url, full_name, node["number"]
+            ),
+        },
+    )
+
+
+def user_pulls(
+    github: "Github", variables: dict, login: str, pulls: dict
+) -> Optional[list]:
+    """Nodes of the open PRs by login, paging through the pulls connection
+    until one is found. None if a page couldn't be fetched."""
+    while True:
+        nodes = [
+            node
+            for node in pulls["nodes"]
+            if (node["headRepositoryOwner"] or {}).get("login") == login
+        ]
+        page = pulls["pageInfo"]
+        if nodes or not page["hasNextPage"]:
+            return nodes
+        try:
+            _, response = github.requester.requestJsonAndCheck(
+                "POST",
+                "/graphql",
+                input={
+                    "query": pulls_query,
+                    "variables": dict(variables, after=page["endCursor"]),
+                },
+            )
+        except GithubException:
+            return None
+        repository = (response.get("data") or {}).get("repository")
+        if not repository:
+            return None
+        pulls = repository["pullRequests"]
+
+
+@traced("presubmit lookup")
+def presubmit_lookup(
+    action: "ConsoleAction",
+    skill_url: Optional[str] = None,
+    branch: Optional[str] = None,
+) -> bool:
+    """Fill the GitHub attributes a submit needs with one GraphQL query
+
+    Sets action.login, action.repo.hub, action.repo.fork_name (None if the
+    user has no fork yet), action.skill_repo (if skill_url is given) and
+    action.repo.open_pulls[branch] (if branch is given and its PRs could be
+    listed). Returns False if the query failed, leaving them to be looked
+    up through REST.
+    """
+    github = action.github
+    repo = action.repo
+    owner, name = skill_repo_name(repo.msminfo.url).split("/")
+    skill_owner, skill_name = (
+        skill_repo_name(skill_url).split("/") if skill_url else ("", "")
+    )
+    variables = {
+        "owner": owner,
+        "name": name,
+        "skillOwner": skill_owner,
+        "skillName": skill_name,
+        "withSkill": bool(skill_url),
+        "branch": branch or "",
+        "base": repo.msminfo.branch,
+        "withPulls": bool(branch),
+    }
+    try:
+        _, response = github.requester.requestJsonAndCheck(
+            "POST",
+            "/graphql",
+            input={"query": presubmit_query, "variables": variables},
+        )
+    except GithubException:
+        return False
+    # Missing repos are reported in "errors" with their fields set to null
+    data = response.get("data") or {}
+    viewer = data.get("viewer")
+    if not viewer:
+        return False
+    action.login = viewer["login"]
+
+    fork = viewer.get("fork")
+    parent = fork and fork["isFork"] and fork["parent"]
+    if (
+        parent
+        and parent["nameWithOwner"].lower() == (owner + "/" + name).lower()
+    ):
+        repo.fork_name = fork["nameWithOwner"]
+    else:
+        repo.fork_name = None  # Created when the branch is pushed
+
+    skills = data.get("skills")
+    if skills:
+        full_name = skills["nameWithOwner"]
+        repo.hub = github.get_repo(full_name, lazy=True)
+        if branch:
+            pulls_variables = {
+                key: variables[key]
+                for key in ("owner", "name", "branch", "base")
+            }
+            nodes = user_pulls(
+                github, pulls_variables, action.login, skills["pullRequests"]
+            )
+            if nodes is not None:
+                repo.open_pulls[branch] = [
+                    pull_request(github, full_name, node) for node in nodes
+                ]
+
+    skill = data.get("skill")
+    if skill:
+        action.skill_repo = repository(
+            github,
+            skill["nameWithOwner"],
+            html_url=skill["url"],
+            permissions={
+                "push": skill["viewerPermission"] in push_permissions
+            },
+        )
+    return True
@@ -15,18 +15,81 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from github import Github
-from github.AuthenticatedUser import AuthenticatedUser
-from msm import MycroftSkillsManager
+from typing import TYPE_CHECKING, Optional
 
 from msk.lazy import Lazy, unset
-from msk.util import ask_for_github_token
+from msk.util import ask_for_github_token, ensure_git_user, get_github_login
+
+if TYPE_CHECKING:
+    from github import Github
+    from github.AuthenticatedUser import AuthenticatedUser
+    from msm import MycroftSkillsManager, SkillRepo
+    from msk.skill_index import SkillIndex
+
+
+def create_skills_repo(context: "GlobalContext") -> "SkillRepo":
+    if context.partial_clone:
+        from msk.partial_repo import PartialSkillRepo as SkillRepo
+    else:
+        from msm import SkillRepo
+
+    return SkillRepo(
+        url=context.skills_repo_url, branch=context.skills_repo_branch
+    )
+
+
+def create_msm(context: "GlobalContext") -> "MycroftSkillsManager":
+    from msm import MycroftSkillsManager
+
+    return MycroftSkillsManager(
+        skills_dir=context.skills_dir, repo=context.skills_repo
+    )
+
+
+def find_skills_folder(context: "GlobalContext") -> str:
+    """Folder of the installed skills, resolved as msm does it"""
+    if context.skills_dir:
+        return context.skills_dir
+    from xdg import BaseDirectory
+
+    return BaseDirectory.save_data_path("mycroft/skills")
+
+
+def create_skill_index(context: "GlobalContext") -> "SkillIndex":
+    from msk.skill_index import SkillIndex
+
+    return SkillIndex(context.msm)
 
 
 class GlobalContext:
+    """Values shared by everything in a single msk invocation
+
+    Each part is only built the first time it is accessed so commands that
+    never touch git, msm or GitHub don't pay for them.
+    """
+
     lang = Lazy(unset)  # type: str
-    msm = Lazy(unset)  # type: MycroftSkillsManager
+    skills_dir = Lazy(lambda s: None)  # type: Optional[str]
+    skills_repo_url = Lazy(lambda s: None)  # type: Optional[str]
+    skills_repo_branch = Lazy(lambda s: None)  # type: Optional[str]
+    partial_clone = Lazy(lambda s: False)  # type: bool
+    clone_free = Lazy(lambda s: False)  # type: bool
+    git_user = Lazy(lambda s: ensure_git_user())  # type: None
+    skills_repo = Lazy(create_skills_repo)  # type: SkillRepo
+    msm = Lazy(create_msm)  # type: MycroftSkillsManager
+    skills_folder = Lazy(find_skills_folder)  # type: str
+    skills = Lazy(create_skill_index)  # type: SkillIndex
     use_token = Lazy(unset)  # type: bool
-    branch = Lazy(unset)  # type: str
+    branch = Lazy(lambda s: s.skills_repo.branch)  # type: str
     github = Lazy(lambda s: ask_for_github_token())  # type: Github
     user = Lazy(lambda s: s.github.get_user())  # type: AuthenticatedUser
+    login = Lazy(lambda s: get_github_login(s.github))  # type: str
+
+    def prepare(self, *parts: str):
+        """Build the given parts of the context up front
+
+        Used so interactive setup (git identity, GitHub token) happens
+        before an action starts doing any work.
+        """
+        for part in parts:
+            getattr(self, part)
@@ -15,7 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from functools import wraps
+import time
+from functools import reduce, wraps
+from os.path import join
+from threading import RLock
+from weakref import WeakKeyDictionary
+
+from msk.util import tokendir
+
+# Modules only needed once a value is computed, stored or prefetched are
+# imported there, to keep them out of the startup of every msk command
 
 
 def unset():
@@ -30,12 +39,225 @@ class Lazy:
     def __init__(self, func):
         wraps(func)(self)
         self.func = func
+        self.name = func.__name__
+        self.qualname = func.__qualname__
         self.return_val = self.initial_val
+        self.lock = RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.qualname = owner.__qualname__ + "." + name
 
     def __set__(self, instance, value):
         self.return_val = value
 
     def __get__(self, instance, owner):
         if self.return_val is self.initial_val:
-            self.return_val = self.func(instance)
+            from msk.trace import span
+
+            with self.lock, span(self.qualname, "lazy"):
+                if self.return_val is self.initial_val:
+                    self.return_val = self.func(instance)
         return self.return_val
+
+    def invalidate(self, instance=None):
+        """Forget the value so it is computed again on next access"""
+        self.return_val = self.initial_val
+
+
+class InstanceLazy(Lazy):
+    """Lazy attribute cached separately for each instance
+
+    The first access of an instance is guarded by a lock so concurrent
+    threads compute the value only once. Values live in the instance
+    __dict__, classes using __slots__ need a __weakref__ slot instead.
+    """
+
+    def __init__(self, func):
+        super().__init__(func)
+        self.instance_locks = WeakKeyDictionary()
+        self.slot_values = WeakKeyDictionary()
+
+    def values(self, instance) -> dict:
+        if hasattr(instance, "__dict__"):
+            return instance.__dict__
+        with self.lock:
+            return self.slot_values.setdefault(instance, {})
+
+    def __set__(self, instance, value):
+        self.values(instance)[self.name] = value
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        values = self.values(instance)
+        value = values.get(self.name, self.initial_val)
+        if value is not self.initial_val:
+            return value
+        from msk.trace import span
+
+        with self.lock:
+            instance_lock = self.instance_locks.setdefault(instance, RLock())
+        with instance_lock, span(self.qualname, "lazy"):
+            value = values.get(self.name, self.initial_val)
+            if value is self.initial_val:
+                value = values[self.name] = self.func(instance)
+        return value
+
+    def invalidate(self, instance=None):
+        """Forget the value of the instance"""
+        self.values(instance).pop(self.name, None)
+
+
+class ValueCache:
+    """Small JSON file of values kept between msk invocations
+
+    Only the most recently used max_entries values are kept, so entries
+    whose inputs changed are dropped over time.
+    """
+
+    def __init__(self, path: str, max_entries: int = 512):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = RLock()
+        self.entries = None
+
+    def load(self) -> dict:
+        if self.entries is None:
+            import json
+
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            entry = self.load().get(key)
+            if entry is None:
+                return default
+            entry["used"] = time.time()
+            return entry["value"]
+
+    def put(self, key: str, value):
+        self.update({key: value})
+
+    def update(self, values: dict):
+        """Store several values, writing the file at most once"""
+        with self.lock:
+            entries = self.load()
+            now = time.time()
+            changed = False
+            for key, value in values.items():
+                entry = entries.get(key)
+                changed = changed or not entry or entry["value"] != value
+                entries[key] = {"value": value, "used": now}
+            if not changed:
+                return
+            import json
+            from msk.locking import atomic_write, file_lock
+
+            with file_lock(self.path, "cache"):
+                # Keep what other processes stored since the file was read
+                self.entries = None
+                for key, entry in self.load().items():
+                    if key not in entries:
+                        entries[key] = entry
+                    elif key not in values:
+                        entries[key]["used"] = max(
+                            entries[key]["used"], entry["used"]
+                        )
+                for old_key in sorted(
+                    entries, key=lambda k: entries[k]["used"]
+                )[: max(0, len(entries) - self.max_entries)]:
+                    del entries[old_key]
+                self.entries = entries
+                with atomic_write(self.path) as f:
+                    json.dump(entries, f)
+
+
+value_cache = ValueCache(join(tokendir, "cache", "lazy.json"))
+
+
+class PersistentLazy(InstanceLazy):
+    """InstanceLazy whose value is also stored on disk across invocations
+
+    The key function returns the inputs the value depends on (ie. a repo
+    url and commit SHA) as a JSON serializable list. The stored value is
+    only used while those inputs stay the same, and nothing is stored while
+    an input is unknown (None). Values must be JSON serializable.
+    """
+
+    def __init__(self, func, key, cache: ValueCache = None):
+        super().__init__(func)
+        self.key = key
+        self.cache = cache or value_cache
+        self.compute = self.func
+        self.func = self.load
+
+    def cache_key(self, instance, inputs: list) -> str:
+        import json
+        from hashlib import sha256
+
+        return sha256(
+            json.dumps([type(instance).__qualname__, self.name, inputs])
+            .encode()
+        ).hexdigest()
+
+    def load(self, instance):
+        inputs = self.key(instance)
+        if None in inputs:
+            return self.compute(instance)
+        key = self.cache_key(instance, inputs)
+        value = self.cache.get(key, self.initial_val)
+        if value is self.initial_val:
+            value = self.compute(instance)
+            self.cache.put(key, value)
+        return value
+
+    def __set__(self, instance, value):
+        """Replace the value, ie. after finding out the stored one is stale"""
+        super().__set__(instance, value)
+        inputs = self.key(instance)
+        if None not in inputs:
+            self.cache.put(self.cache_key(instance, inputs), value)
+
+
+def persistent(key):
+    """Decorator creating a PersistentLazy with the given key function"""
+    return lambda func: PersistentLazy(func, key)
+
+
+def reset(instance, *names):
+    """Invalidate the given Lazy attributes of an instance, or all of its
+    InstanceLazy attributes if no names are given"""
+    for cls in type(instance).__mro__:
+        for name, attr in vars(cls).items():
+            if not isinstance(attr, Lazy):
+                continue
+            if name in names or (
+                not names and isinstance(attr, InstanceLazy)
+            ):
+                attr.invalidate(instance)
+
+
+def prefetch(instance, *names, max_workers=8):
+    """Resolve independent Lazy attributes concurrently
+
+    Names may be dotted to reach attributes of other objects, ie.
+    prefetch(action, "user", "repo.hub", "repo.fork_name"). Errors are ignored
+    here; the attribute is left unresolved so the exception is raised
+    where it is normally used.
+    """
+    def resolve(name):
+        try:
+            reduce(getattr, name.split("."), instance)
+        except Exception:
+            pass
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(min(max_workers, len(names) or 1)) as pool:
+        list(pool.map(resolve, names))
@@ -0,0 +1,118 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Locks and writes for state shared between msk processes
+
+Several msk processes (ie. CI jobs on one host) can share a skills repo
+clone, the token store and the caches. Changes to them are made while
+holding a file lock and files are replaced with a rename, so readers never
+see a partially written file. The time spent waiting for a lock is
+reported as a "lock" span, visible in --trace and in msk stats.
+"""
+
+import os
+import re
+from contextlib import contextmanager
+from hashlib import sha256
+from os.path import basename, dirname, join
+from tempfile import mkstemp
+from threading import Lock, RLock
+
+from msk.trace import span
+from msk.util import tokendir
+
+lock_dir = join(tokendir, "locks")
+
+
+class FileLock:
+    """Lock held by one thread of one process at a time
+
+    Reentrant, so a function holding it can call others that take it too.
+    """
+
+    def __init__(self, path: str, kind: str):
+        # Imported here to keep it out of the startup of every command
+        from fasteners import InterProcessLock
+
+        self.kind = kind
+        self.path = path
+        self.thread_lock = RLock()
+        self.process_lock = InterProcessLock(path)
+        self.depth = 0
+
+    def __enter__(self):
+        with span(
+            "wait for {} lock".format(self.kind), "lock", path=self.path
+        ):
+            self.thread_lock.acquire()
+            if self.depth == 0:
+                try:
+                    self.process_lock.acquire()
+                except BaseException:
+                    # Leave the lock free for the other threads
+                    self.thread_lock.release()
+                    raise
+            self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            self.process_lock.release()
+        self.thread_lock.release()
+
+
+locks = {}  # type: dict
+locks_lock = Lock()
+
+
+def file_lock(key: str, kind: str) -> FileLock:
+    """Get the lock for a file, folder or other key (ie. a repo branch)
+
+    The lock files are kept apart from the locked files in lock_dir, so
+    they don't get in the way of git's own .lock files.
+    """
+    name = "{}-{}-{}.lock".format(
+        kind,
+        re.sub(r"[^\w.-]", "_", basename(key.rstrip("/")))[:40],
+        sha256(key.encode()).hexdigest()[:12],
+    )
+    path = join(lock_dir, name)
+    with locks_lock:
+        if path not in locks:
+            locks[path] = FileLock(path, kind)
+        return locks[path]
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w"):
+    """Write a file by renaming a complete temporary copy over it
+
+    The file is only readable by the user, like the token files need.
+    """
+    folder = dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = mkstemp(dir=folder, prefix=basename(path) + ".")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,83 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Partial, shallow and sparse working copy of the skills repo
+
+Meant for ephemeral CI runners: the clone skips file contents it doesn't
+check out (--filter=blob:none), only fetches the last commits of the
+branch and only checks out .gitmodules and the DEFAULT-SKILLS files. msk
+changes submodules in worktrees without a checkout, so nothing else is
+needed.
+"""
+
+import os
+from os import makedirs
+from os.path import dirname, isdir, join
+
+from git import Git, GitCommandError, Repo
+from msm import SkillRepo
+from msm.exceptions import MsmException
+from xdg import BaseDirectory
+
+clone_depth = int(os.environ.get("MSK_CLONE_DEPTH", 1))
+sparse_patterns = ["/.gitmodules", "/DEFAULT-SKILLS*"]
+
+
+class PartialSkillRepo(SkillRepo):
+    def __init__(self, url=None, branch=None):
+        super().__init__(url, branch)
+        # Kept apart from the full clone msm uses
+        self.path = join(
+            BaseDirectory.save_data_path("mycroft"), "skills-repo-partial"
+        )
+
+    @property
+    def sparse_file(self) -> str:
+        return join(self.path, ".git", "info", "sparse-checkout")
+
+    def clone(self):
+        makedirs(dirname(self.path), exist_ok=True)
+        Repo.clone_from(
+            self.url,
+            self.path,
+            filter="blob:none",
+            depth=clone_depth,
+            no_checkout=True,
+            branch=self.branch,
+        )
+        # Written directly instead of using git sparse-checkout, whose
+        # --no-cone option needs git 2.35
+        makedirs(dirname(self.sparse_file), exist_ok=True)
+        with open(self.sparse_file, "w") as f:
+            f.write("\n".join(sparse_patterns) + "\n")
+        Git(self.path).config("core.sparseCheckout", "true")
+
+    def update(self):
+        if not isdir(self.path):
+            self.clone()
+        git = Git(self.path)
+        git.config("remote.origin.url", self.url)
+        try:
+            git.fetch(
+                "origin",
+                "+refs/heads/{0}:refs/remotes/origin/{0}".format(self.branch),
+                depth=clone_depth,
+            )
+            git.checkout("-B", self.branch, "origin/" + self.branch)
+            git.reset("origin/" + self.branch, hard=True)
+        except GitCommandError:
+            raise MsmException("Invalid branch: " + self.branch)
@@ -0,0 +1,268 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Scheduling of GitHub API requests within the rate limits
+
+Every GitHub response carries X-RateLimit-* headers with the requests left
+for its token until the limit resets. Each resource (REST "core", "search",
+"graphql") has a limit of its own, named by X-RateLimit-Resource. The
+RequestScheduler keeps track of them for each token and resource and
+- paces requests once a token is low, spreading what is left until the
+  reset instead of failing halfway through a batch,
+- waits (Retry-After, or until the reset) and retries when a limit was
+  hit anyway,
+- spreads reads whose answer doesn't depend on the user (commits and
+  file contents, see pooled_endpoints) over a pool of tokens. Everything
+  else uses the token msk was set up with, since the other tokens may
+  belong to other users.
+
+Additional tokens are read from MSK_GITHUB_TOKENS (separated by commas or
+whitespace) and from the GITHUB_TOKENS file, one per line.
+
+The budget a command is expected to spend is taken from the GitHub
+request counts of its earlier runs (see msk stats). It is printed with the
+requests left at the first response, with a warning when that is less.
+"""
+
+import os
+import re
+import threading
+import time
+from os.path import isfile, join
+from typing import Dict, List, Optional, Tuple
+
+from msk.trace import span
+from msk.util import tokendir
+
+tokens_env = "MSK_GITHUB_TOKENS"
+tokensfile = join(tokendir, "GITHUB_TOKENS")
+
+# Requests are paced once a token has less than this part of its limit left
+pace_below = 0.1
+# Retries of a request that hit the rate limit
+max_retries = 5
+max_backoff = 60 * 60
+read_methods = {"GET", "HEAD"}
+# Paths answered the same for every token that can see the repo. Requests
+# to them may use any token of the pool.
+pooled_endpoints = [
+    re.compile(r"^/repos/[^/]+/[^/]+/commits/[0-9a-f]{40}$"),
+    re.compile(r"^/repos/[^/]+/[^/]+/contents/"),
+]
+
+scheduler = None  # type: Optional[RequestScheduler]
+command = None  # type: Optional[str]  # Action being run, for the budget
+
+
+def request_resource(request) -> str:
+    """Rate limit resource a request likely counts against"""
+    path = request.path_url.split("?")[0]
+    if path.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in path:
+        return "search"
+    return "core"
+
+
+class TokenState:
+    """Rate limit of one token for one resource, from its last response"""
+
+    def __init__(self, token: str, resource: str):
+        self.token = token
+        self.resource = resource
+        self.limit = None  # type: Optional[int]
+        self.remaining = None  # type: Optional[int]
+        self.reset = 0.0
+
+    def available(self, now: float) -> float:
+        """Requests left, assuming a full budget if nothing is known yet"""
+        if self.remaining is None or now >= self.reset:
+            return float("inf")
+        return self.remaining
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait before sending a request with this token"""
+        if self.remaining is None or now >= self.reset:
+            return 0.0
+        if self.remaining <= 0:
+            return self.reset - now + 1
+        if self.limit and self.remaining < self.limit * pace_below:
+            return (self.reset - now) / self.remaining
+        return 0.0
+
+    def update(self, headers):
+        try:
+            self.limit = int(headers["X-RateLimit-Limit"])
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+            self.reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            pass
+
+
+def load_extra_tokens() -> List[str]:
+    text = os.environ.get(tokens_env, "")
+    if isfile(tokensfile):
+        with open(tokensfile) as f:
+            text += "\n" + f.read()
+    return [token for token in re.split(r"[\s,]+", text) if token]
+
+
+def is_rate_limited(response) -> bool:
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and (
+        "Retry-After" in response.headers
+        or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+
+class RequestScheduler:
+    def __init__(self, tokens: List[str]):
+        self.tokens = list(dict.fromkeys(tokens))
+        self.primary = self.tokens[0]
+        self.states = {}  # type: Dict[Tuple[str, str], TokenState]
+        self.lock = threading.Lock()
+        self.budget_checked = False
+
+    def state(self, token: str, resource: str) -> TokenState:
+        with self.lock:
+            key = (token, resource)
+            if key not in self.states:
+                self.states[key] = TokenState(token, resource)
+            return self.states[key]
+
+    def pooled(self, request) -> bool:
+        """Whether the request may be sent with any token of the pool"""
+        path = request.path_url.split("?")[0]
+        return (
+            request.method in read_methods
+            and len(self.tokens) > 1
+            and request.headers.get("Authorization", "").endswith(
+                " " + self.primary
+            )
+            and any(pattern.match(path) for pattern in pooled_endpoints)
+        )
+
+    def assign_token(self, request) -> bool:
+        """Send a pooled request with the token that has the most requests
+        left. Returns whether that is another token than the primary one.
+        """
+        if not self.pooled(request):
+            return False
+        now = time.time()
+        resource = request_resource(request)
+        states = [self.state(token, resource) for token in self.tokens]
+        with self.lock:
+            state = max(
+                states,
+                key=lambda state: (state.available(now), -state.delay(now)),
+            )
+        self.set_token(request, state.token)
+        return state.token != self.primary
+
+    def restore_token(self, request):
+        """Send a request with the primary token again"""
+        self.set_token(request, self.primary)
+
+    def set_token(self, request, token: str):
+        scheme = request.headers["Authorization"].split(" ")[0]
+        request.headers["Authorization"] = scheme + " " + token
+
+    def request_token(self, request) -> Optional[str]:
+        auth = request.headers.get("Authorization", "")
+        token = auth.split(" ")[-1]
+        return token if token in self.tokens else None
+
+    def wait(self, seconds: float, reason: str):
+        if seconds <= 0:
+            return
+        if seconds > 5:
+            print(
+                "Waiting {:.0f}s for the GitHub rate limit ({})".format(
+                    seconds, reason
+                )
+            )
+        with span("wait for GitHub rate limit", "rate limit", reason=reason):
+            time.sleep(seconds)
+
+    def send(self, send, request, **kwargs):
+        """Send a request with send(request, **kwargs) within the limits
+
+        The request keeps the token it has, see assign_token().
+        """
+        token = self.request_token(request)
+        if token is None:
+            return send(request, **kwargs)  # Not sent with a known token
+        state = self.state(token, request_resource(request))
+        for attempt in range(max_retries + 1):
+            delay = min(state.delay(time.time()), max_backoff)
+            self.wait(delay, "limit hit" if attempt else "pacing")
+            response = send(request, **kwargs)
+            resource = response.headers.get("X-RateLimit-Resource")
+            if resource and resource != state.resource:
+                state = self.state(token, resource)
+            with self.lock:
+                state.update(response.headers)
+            self.check_budget(state)
+            if not is_rate_limited(response) or attempt == max_retries:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                backoff = int(retry_after)
+            elif state.remaining == 0:
+                backoff = state.reset - time.time() + 1
+            else:
+                backoff = 2**attempt * 10
+            with self.lock:
+                # Also keeps pooled requests away from the token until then
+                state.remaining = 0
+                state.reset = time.time() + min(backoff, max_backoff)
+        return response
+
+    def check_budget(self, state: TokenState):
+        """Report once what the command likely needs and what is left"""
+        if self.budget_checked or state.remaining is None or not command:
+            return
+        self.budget_checked = True
+        from msk.stats import expected_requests
+
+        expected = expected_requests(command)
+        left = "{} ({}) are left until {}".format(
+            state.remaining,
+            state.resource,
+            time.strftime("%H:%M", time.localtime(state.reset)),
+        )
+        if not expected:
+            print("GitHub requests: " + left + ".")
+        elif state.remaining < expected:
+            print(
+                "msk {} usually makes up to {} GitHub requests, but only {}, "
+                "so it may have to wait.".format(command, expected, left)
+            )
+        else:
+            print(
+                "msk {} usually makes up to {} GitHub requests, {}.".format(
+                    command, expected, left
+                )
+            )
+
+
+def start_scheduler(token: str) -> RequestScheduler:
+    """Schedule the GitHub requests of msk, made with token and the pool"""
+    global scheduler
+    scheduler = RequestScheduler([token.strip()] + load_extra_tokens())
+    return scheduler
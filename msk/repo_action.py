@@ -15,47 +15,273 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from contextlib import suppress
+import shutil
+import time
+from contextlib import contextmanager, suppress
 from git import Git, GitCommandError
+from github import (
+    GithubException,
+    InputGitTreeElement,
+    UnknownObjectException,
+)
+from github.Commit import Commit
 from github.Repository import Repository
 from msm import SkillRepo, SkillEntry
-from os.path import join
+from msm.util import MsmProcessLock
+from os import listdir, makedirs
+from os.path import getmtime, join, isfile
 from subprocess import call
+from tempfile import mkdtemp
+from typing import Dict, Optional
 
-from msk.exceptions import AlreadyUpdated, NotUploaded
+from msk.exceptions import AlreadyUpdated, MskException, NotUploaded
+from msk.git_objects import read_blob, tree_entry
 from msk.global_context import GlobalContext
-from msk.lazy import Lazy
+from msk.lazy import InstanceLazy, Lazy, persistent, reset
+from msk.locking import FileLock, file_lock
+from msk.skill_catalog import (
+    GITLINK_MODE,
+    SkillCatalog,
+    Submodule,
+    parse_gitmodules_text,
+    url_key,
+)
+from msk.trace import span, traced
 from msk.util import skill_repo_name
 
+# Worktrees left behind by msk processes that didn't finish are removed
+# once they are this old (in seconds)
+worktree_max_age = 60 * 60
+
+
+# Section added to .gitmodules for new skills, as git submodule add writes it
+gitmodules_entry = '[submodule "{name}"]\n\tpath = {name}\n\turl = {url}\n'
+
+
+def read_ref(repo_path: str, ref: str) -> Optional[str]:
+    """Read the SHA of a ref without starting git"""
+    git_dir = join(repo_path, ".git")
+    if isfile(join(git_dir, ref)):
+        with open(join(git_dir, ref)) as f:
+            return f.read().strip()
+    if isfile(join(git_dir, "packed-refs")):
+        with open(join(git_dir, "packed-refs")) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def remote_head(git: Git, url: str) -> str:
+    """Get the SHA the default branch of a remote repo points to"""
+    return git.ls_remote(url, "HEAD").split("\t")[0]
+
 
 class RepoData(GlobalContext):
-    msminfo = Lazy(lambda s: s.msm.repo)  # type: SkillRepo
-    git = Lazy(lambda s: Git(s.msminfo.path))  # type: Git
-    hub = Lazy(
+    msminfo = InstanceLazy(lambda s: s.skills_repo)  # type: SkillRepo
+    git = InstanceLazy(lambda s: Git(s.msminfo.path))  # type: Git
+    hub = InstanceLazy(
         lambda s: s.github.get_repo(skill_repo_name(s.msminfo.url))
     )  # type: Repository
-    fork = Lazy(
-        lambda s: s.github.get_user().create_fork(s.hub)
+    # Built from the name without a request, completed when first used
+    fork = InstanceLazy(
+        lambda s: s.github.get_repo(s.fork_name, lazy=True)
     )  # type: Repository
+    fork_url = InstanceLazy(
+        lambda s: "https://github.com/" + s.fork_name
+    )  # type: str
+    head_sha = InstanceLazy(
+        lambda s: read_ref(
+            s.msminfo.path, "refs/remotes/origin/" + s.msminfo.branch
+        )
+    )  # type: Optional[str]
+    worktrees_dir = InstanceLazy(
+        lambda s: s.msminfo.path + "-worktrees"
+    )  # type: str
+    remote_base = InstanceLazy(
+        lambda s: s.hub.get_branch(s.msminfo.branch).commit
+    )  # type: Commit
+    updated = False  # Whether update() ran in this process
+    # Open PRs of the user's branches, if already known
+    open_pulls = InstanceLazy(lambda s: {})  # type: Dict[str, list]
+    # Held while changing the clone, its config or its list of worktrees
+    lock = InstanceLazy(
+        lambda s: file_lock(s.msminfo.path, "repo")
+    )  # type: FileLock
 
-    def push_to_fork(self, branch: str):
-        remotes = self.git.remote().split("\n")
-        command = "set-url" if "fork" in remotes else "add"
-        self.git.remote(command, "fork", self.fork.html_url)
+    @persistent(lambda s: [s.msminfo.url, s.login])
+    def fork_name(self) -> Optional[str]:
+        """Full name of the user's fork of the skills repo, if there is one"""
+        fork = self.find_fork()
+        return fork and fork.full_name
+
+    def find_fork(self) -> Optional[Repository]:
+        """Look up the user's fork of the skills repo without creating it"""
+        upstream = skill_repo_name(self.msminfo.url)
+        name = self.login + "/" + upstream.split("/")[1]
+        with suppress(UnknownObjectException):
+            repo = self.github.get_repo(name)
+            if repo.fork and repo.parent.full_name.lower() == upstream.lower():
+                return repo
+        return None
+
+    def create_fork(self):
+        """Find the user's fork again, creating it if there is none"""
+        fork = self.find_fork() or self.user.create_fork(self.hub)
+        self.fork_name = fork.full_name
+        reset(self, "fork", "fork_url")
+
+    @traced("fork sync")
+    def sync_fork(self):
+        """Bring the branch of the fork up to date with the skills repo
 
+        GitHub merges it on its side, so a push afterwards only uploads
+        the new commit. The fork is created here if needed, so nothing is
+        written to the user's account before a branch is pushed.
+        """
+        if not self.fork_name:
+            self.create_fork()
+        try:
+            self.fork.merge_upstream(self.msminfo.branch)
+        except UnknownObjectException:
+            # The stored fork may have been deleted or renamed
+            self.create_fork()
+            with suppress(GithubException):
+                self.fork.merge_upstream(self.msminfo.branch)
+        except GithubException:
+            pass  # ie. the branch diverged, a push still works
+
+    @InstanceLazy
+    def catalog(self) -> SkillCatalog:
+        catalog = SkillCatalog(self.msminfo.url)
+        if self.head_sha:
+            catalog.update(self.git, self.head_sha)
+        return catalog
+
+    @traced("repo update")
+    def update(self):
+        """Bring the skills repo clone and its catalog up to date
+
+        Fetches once per run, later calls use what was fetched then.
+        """
+        if self.updated:
+            return
+        # msm processes use their own lock for the clone
+        with self.lock, MsmProcessLock():
+            self.msminfo.update()
+            reset(self, "head_sha")
+            if self.head_sha:
+                self.catalog.update(self.git, self.head_sha)
+        self.updated = True
+
+    @traced("push")
+    def push_to_fork(self, branch: str):
+        self.sync_fork()
+        # Pushing to the url leaves the shared git config untouched.
         # Use call to ensure the environment variable GIT_ASKPASS is used
-        call(
-            ["git", "push", "-u", "fork", branch, "--force"],
-            cwd=self.msminfo.path,
-        )
+        with self.branch_lock(branch), span("git push", "git", branch=branch):
+            call(
+                ["git", "push", "--force", self.fork_url, branch],
+                cwd=self.msminfo.path,
+            )
+
+    def read_remote_file(self, path: str) -> Optional[str]:
+        """Read a file of the remote branch through the GitHub API"""
+        try:
+            contents = self.hub.get_contents(path, ref=self.remote_base.sha)
+        except UnknownObjectException:
+            return None
+        return contents.decoded_content.decode()
+
+    def remote_gitlink(self, path: str) -> Optional[str]:
+        """Commit a submodule of the remote branch points to"""
+        try:
+            contents = self.hub.get_contents(path, ref=self.remote_base.sha)
+        except UnknownObjectException:
+            return None
+        return contents.sha if contents.type == "submodule" else None
 
-    def checkout_branch(self, branch):
-        with suppress(GitCommandError):
-            self.git.branch("-D", branch)
+    @traced("remote commit")
+    def commit_remotely(
+        self, branch: str, message: str, path: str, sha: str, gitmodules=None
+    ):
+        """Point branch of the fork to a new commit on top of the remote
+        branch, with the gitlink at path set to sha
+
+        Uses the Git Data API, so no clone is needed. If given, the
+        .gitmodules file is replaced as well.
+        """
+        self.sync_fork()
+        base = self.remote_base.commit
+        elements = [InputGitTreeElement(path, GITLINK_MODE, "commit", sha=sha)]
+        if gitmodules is not None:
+            elements.append(
+                InputGitTreeElement(
+                    ".gitmodules", "100644", "blob", content=gitmodules
+                )
+            )
+        tree = self.fork.create_git_tree(elements, base.tree)
+        commit = self.fork.create_git_commit(message, tree, [base])
         try:
-            self.git.checkout(b=branch)
-        except GitCommandError:
-            self.git.checkout(branch)
+            ref = self.fork.get_git_ref("heads/" + branch)
+        except UnknownObjectException:
+            self.fork.create_git_ref("refs/heads/" + branch, commit.sha)
+        else:
+            ref.edit(commit.sha, force=True)
+
+    def branch_lock(self, branch: str) -> FileLock:
+        """Lock for a branch of the user's fork
+
+        Actions hold it from creating the branch until it is pushed, so
+        another msk process can't replace the branch in between.
+        """
+        return file_lock(self.msminfo.path + ":" + branch, "branch")
+
+    def prune_worktrees(self):
+        expired = time.time() - worktree_max_age
+        for name in listdir(self.worktrees_dir):
+            path = join(self.worktrees_dir, name)
+            if getmtime(path) < expired:
+                shutil.rmtree(path, ignore_errors=True)
+        self.git.worktree("prune")
+
+    @contextmanager
+    def worktree(self, branch: str):
+        """Create branch from the remote branch in a worktree of its own
+
+        The worktree shares objects and refs with the clone but has its own
+        index, so operations running at the same time don't interfere.
+        Nothing is checked out; changes are made to the index only. The
+        worktree is removed when the block exits.
+        """
+        with self.branch_lock(branch):
+            with self.lock:
+                makedirs(self.worktrees_dir, exist_ok=True)
+                self.prune_worktrees()
+                path = mkdtemp(prefix=branch + "-", dir=self.worktrees_dir)
+                try:
+                    self.git.worktree(
+                        "add",
+                        "--no-checkout",
+                        "-B",
+                        branch,
+                        path,
+                        "origin/" + self.msminfo.branch,
+                    )
+                except GitCommandError:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise MskException(
+                        f"Couldn't create branch {branch}, is it checked "
+                        "out in the skills repo?"
+                    )
+            try:
+                git = Git(path)
+                git.read_tree("HEAD")
+                yield git
+            finally:
+                with self.lock:
+                    self.git.worktree("remove", "--force", path)
 
 
 class SkillData(GlobalContext):
@@ -63,70 +289,124 @@ class SkillData(GlobalContext):
         self.entry = skill
 
     name = property(lambda self: self.entry.name)
+    upgrade_branch = property(lambda self: "upgrade-" + self.name)
+    add_branch = property(lambda self: "add-" + self.name)
     repo = Lazy(lambda s: RepoData())  # type: RepoData
-    repo_git = Lazy(
-        lambda s: Git(join(s.repo.msminfo.path, s.submodule_name))
-    )  # type: Git
-    repo_branch = Lazy(
-        lambda s: s.repo_git.symbolic_ref("refs/remotes/origin/HEAD")
-    )
-    git = Lazy(lambda s: Git(s.entry.path))  # type: Git
-    hub = Lazy(
+    git = InstanceLazy(lambda s: Git(s.entry.path))  # type: Git
+    hub = InstanceLazy(
         lambda s: s.github.get_repo(skill_repo_name(s.entry.url))
     )  # type: Repository
+    submodule_name = InstanceLazy(lambda s: s.submodule.path)  # type: str
 
-    @Lazy
-    def submodule_name(self):
-        name_to_path = {
-            name: path
-            for name, path, url, sha in self.repo.msminfo.get_skill_data()
-        }
-        if self.name not in name_to_path:
+    @InstanceLazy
+    def submodule(self) -> Submodule:
+        """Find the skill by its url in the updated skills repo"""
+        self.repo.update()
+        submodule = self.repo.catalog.by_url(self.entry.url)
+        if not submodule:
             raise NotUploaded(
                 f"The skill {self.name} has not yet been uploaded to the "
                 "skill store"
             )
-        return name_to_path[self.name]
+        return submodule
+
+    @InstanceLazy
+    def remote_submodule(self) -> dict:
+        """Find the skill by its url in .gitmodules of the remote branch
+
+        Returns the path and url of the submodule along with its name.
+        """
+        gitmodules = self.repo.read_remote_file(".gitmodules") or ""
+        key = url_key(self.entry.url)
+        for name, info in parse_gitmodules_text(gitmodules).items():
+            if url_key(info["url"]) == key:
+                return dict(info, name=name)
+        raise NotUploaded(
+            f"The skill {self.name} has not yet been uploaded to the "
+            "skill store"
+        )
 
     def upgrade(self) -> str:
+        if self.clone_free:
+            return self.upgrade_remotely()
+        self.repo.update()
         skill_module = self.submodule_name
-        submod = Git(join(self.repo.msminfo.path, skill_module))
-        submod.remote("set-head", "origin", "-a")
-        self.repo.msminfo.update()
-        self.repo_git.fetch()
-        self.repo_git.reset(self.repo_branch, hard=True)
-
-        upgrade_branch = "upgrade-" + self.name
-        self.repo.checkout_branch(upgrade_branch)
-
-        if not self.repo.git.diff(skill_module) and self.repo.git.ls_files(
-            skill_module
-        ):
+        latest = remote_head(self.repo.git, self.submodule.url)
+        uploaded = tree_entry(self.repo.git, self.repo.head_sha, skill_module)
+        if uploaded and uploaded.sha == latest:
+            raise AlreadyUpdated(
+                f"The latest version of {self.name} is already uploaded to "
+                "the skill repo"
+            )
+        if uploaded:
+            self.entry.sha = uploaded.sha
+
+        upgrade_branch = self.upgrade_branch
+        with self.repo.worktree(upgrade_branch) as git:
+            gitlink = "160000,{},{}".format(latest, skill_module)
+            git.update_index("--cacheinfo", gitlink)
+            git.commit(message="Upgrade " + self.name)
+        return upgrade_branch
+
+    def upgrade_remotely(self) -> str:
+        submodule = self.remote_submodule
+        latest = remote_head(Git(), submodule["url"])
+        uploaded = self.repo.remote_gitlink(submodule["path"])
+        if uploaded == latest:
             raise AlreadyUpdated(
                 f"The latest version of {self.name} is already uploaded to "
                 "the skill repo"
             )
-        self.repo.git.add(skill_module)
-        self.repo.git.commit(message="Upgrade " + self.name)
+        if uploaded:
+            self.entry.sha = uploaded
+        upgrade_branch = self.upgrade_branch
+        self.repo.commit_remotely(
+            upgrade_branch, "Upgrade " + self.name, submodule["path"], latest
+        )
         return upgrade_branch
 
     def add_to_repo(self) -> str:
-        self.repo.msminfo.update()
-        existing_mods = [
-            i.split("\t")[1] for i in self.git.ls_tree("HEAD").split("\n")
-        ]
-        if self.name not in existing_mods:
-            self.repo.git.submodule("add", self.entry.url, self.name)
-
-        # Upgrade skill in case it is outdated
-        self.repo_git.fetch()
-        self.repo_git.reset(self.repo_branch, hard=True)
-
-        branch_name = "add-" + self.name
-        self.repo.checkout_branch(branch_name)
-        self.repo.git.add(self.name)
-        self.repo.git.commit(message="Add " + self.name)
+        if self.clone_free:
+            return self.add_remotely()
+        self.repo.update()
+        # Upload the latest version of the skill
+        latest = remote_head(self.repo.git, self.entry.url)
+
+        branch_name = self.add_branch
+        with self.repo.worktree(branch_name) as git:
+            if not self.repo.catalog.by_path(self.name):
+                gitmodules = read_blob(
+                    self.repo.git, self.repo.head_sha + ":.gitmodules"
+                )
+                with open(join(git.working_dir, ".gitmodules"), "w") as f:
+                    f.write(gitmodules or "")
+                section = "submodule." + self.name
+                git.config("-f", ".gitmodules", section + ".path", self.name)
+                git.config(
+                    "-f", ".gitmodules", section + ".url", self.entry.url
+                )
+                git.add(".gitmodules")
+            gitlink = "160000,{},{}".format(latest, self.name)
+            git.update_index("--add", "--cacheinfo", gitlink)
+            git.commit(message="Add " + self.name)
         return branch_name
 
-    def init_existing(self):
-        self.repo.git.submodule("update", "--init", self.submodule_name)
+    def add_remotely(self) -> str:
+        latest = remote_head(Git(), self.entry.url)
+        gitmodules = self.repo.read_remote_file(".gitmodules") or ""
+        paths = {
+            info["path"] for info in parse_gitmodules_text(gitmodules).values()
+        }
+        if self.name in paths:
+            gitmodules = None  # Only update the existing submodule
+        else:
+            if gitmodules.strip():
+                gitmodules = gitmodules.rstrip("\n") + "\n"
+            gitmodules += gitmodules_entry.format(
+                name=self.name, url=self.entry.url
+            )
+        branch_name = self.add_branch
+        self.repo.commit_remotely(
+            branch_name, "Add " + self.name, self.name, latest, gitmodules
+        )
+        return branch_name
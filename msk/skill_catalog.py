@@ -0,0 +1,236 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""On-disk catalog of the submodules of the skills repo
+
+The catalog is stored in SQLite and brought up to date incrementally:
+only the gitlinks changed between the last indexed commit and the new
+one are touched, and .gitmodules is only parsed again when it changed.
+"""
+
+import re
+import sqlite3
+from collections import namedtuple
+from os import makedirs
+from os.path import dirname, join
+from threading import RLock
+from typing import Dict, Optional
+
+from git import Git, GitCommandError
+
+from msk.util import tokendir
+
+catalog_file = join(tokendir, "cache", "skills_catalog.sqlite")
+
+Submodule = namedtuple("Submodule", "name path url sha branch")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submodules (
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    url TEXT NOT NULL,
+    sha TEXT NOT NULL DEFAULT '',
+    branch TEXT,
+    PRIMARY KEY (repo, name)
+);
+CREATE INDEX IF NOT EXISTS submodules_path ON submodules (repo, path);
+CREATE INDEX IF NOT EXISTS submodules_url ON submodules (repo, url);
+CREATE TABLE IF NOT EXISTS indexed (
+    repo TEXT PRIMARY KEY,
+    sha TEXT NOT NULL
+);
+"""
+
+GITLINK_MODE = "160000"
+
+
+def complete_modules(modules: Dict[str, dict]) -> Dict[str, dict]:
+    return {
+        name: info
+        for name, info in modules.items()
+        if "path" in info and "url" in info
+    }
+
+
+def parse_gitmodules(git: Git, commit: str) -> Dict[str, dict]:
+    """Read .gitmodules of a commit as {name: {"path": .., "url": ..}}"""
+    try:
+        output = git.config("--blob", commit + ":.gitmodules", "-z", "--list")
+    except GitCommandError:
+        return {}
+    modules = {}
+    for item in output.split("\0"):
+        if "\n" not in item or not item.startswith("submodule."):
+            continue
+        key, value = item.split("\n", 1)
+        name, option = key[len("submodule."):].rsplit(".", 1)
+        modules.setdefault(name, {})[option] = value
+    return complete_modules(modules)
+
+
+def url_key(url: str) -> str:
+    """Owner and name of the repo a url points to, for comparing urls"""
+    url = url.strip().rstrip("/").lower().replace(":", "/")
+    if url.endswith(".git"):
+        url = url[:-len(".git")]
+    return "/".join(url.split("/")[-2:])
+
+
+def parse_gitmodules_text(text: str) -> Dict[str, dict]:
+    """Parse the contents of a .gitmodules file fetched without git"""
+    modules = {}
+    info = {}
+    for line in text.split("\n"):
+        section = re.match(r'^\s*\[submodule\s+"(.*)"\s*\]', line)
+        option = re.match(r"^\s*([\w-]+)\s*=\s*(.*?)\s*$", line)
+        if section:
+            info = modules.setdefault(section.group(1), {})
+        elif option:
+            info[option.group(1).lower()] = option.group(2)
+    return complete_modules(modules)
+
+
+class SkillCatalog:
+    """Name, path, url, gitlink SHA and branch of every skill submodule"""
+
+    def __init__(self, repo: str, filename: str = catalog_file):
+        self.repo = repo
+        makedirs(dirname(filename), exist_ok=True)
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = RLock()
+
+    @property
+    def indexed_sha(self) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT sha FROM indexed WHERE repo = ?", (self.repo,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def update(self, git: Git, sha: str):
+        """Index the skills repo at the given commit"""
+        with self.lock, self.db:
+            last_sha = self.indexed_sha
+            if last_sha == sha:
+                return
+            changes = None
+            if last_sha:
+                try:
+                    changes = git.diff_tree(
+                        "-r", "--no-renames", "--raw", last_sha, sha
+                    )
+                except GitCommandError:
+                    pass  # Last indexed commit is gone, ie. after a rebase
+            if changes is None:
+                self.rebuild(git, sha)
+            else:
+                self.apply_changes(git, sha, changes)
+            self.db.execute(
+                "INSERT OR REPLACE INTO indexed (repo, sha) VALUES (?, ?)",
+                (self.repo, sha),
+            )
+
+    def store_gitmodules(self, git: Git, sha: str):
+        modules = parse_gitmodules(git, sha)
+        existing = {
+            name
+            for name, in self.db.execute(
+                "SELECT name FROM submodules WHERE repo = ?", (self.repo,)
+            )
+        }
+        self.db.executemany(
+            "DELETE FROM submodules WHERE repo = ? AND name = ?",
+            [(self.repo, name) for name in existing - set(modules)],
+        )
+        self.db.executemany(
+            "INSERT OR IGNORE INTO submodules (repo, name, path, url) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (self.repo, name, info["path"], info["url"])
+                for name, info in modules.items()
+            ],
+        )
+        self.db.executemany(
+            "UPDATE submodules SET path = ?, url = ?, branch = ? "
+            "WHERE repo = ? AND name = ?",
+            [
+                (
+                    info["path"],
+                    info["url"],
+                    info.get("branch"),
+                    self.repo,
+                    name,
+                )
+                for name, info in modules.items()
+            ],
+        )
+
+    def rebuild(self, git: Git, sha: str):
+        self.store_gitmodules(git, sha)
+        for line in git.ls_tree("-r", sha).split("\n"):
+            info, _, path = line.partition("\t")
+            if info.startswith(GITLINK_MODE):
+                self.set_sha(path, info.split()[2])
+
+    def apply_changes(self, git: Git, sha: str, changes: str):
+        gitlinks = []
+        for line in changes.split("\n"):
+            info, _, path = line.partition("\t")
+            if not info:
+                continue
+            old_mode, new_mode, _, new_sha, status = info[1:].split()
+            if path == ".gitmodules":
+                self.store_gitmodules(git, sha)
+            elif GITLINK_MODE in (old_mode, new_mode):
+                gitlinks.append((path, "" if status == "D" else new_sha))
+        for path, gitlink_sha in gitlinks:
+            self.set_sha(path, gitlink_sha)
+
+    def set_sha(self, path: str, sha: str):
+        self.db.execute(
+            "UPDATE submodules SET sha = ? WHERE repo = ? AND path = ?",
+            (sha, self.repo, path),
+        )
+
+    def find(self, column: str, value: str) -> Optional[Submodule]:
+        row = self.db.execute(
+            "SELECT name, path, url, sha, branch FROM submodules "
+            "WHERE repo = ? AND {} = ?".format(column),
+            (self.repo, value),
+        ).fetchone()
+        return Submodule(*row) if row else None
+
+    def by_name(self, name: str) -> Optional[Submodule]:
+        return self.find("name", name)
+
+    def by_path(self, path: str) -> Optional[Submodule]:
+        return self.find("path", path)
+
+    def by_url(self, url: str) -> Optional[Submodule]:
+        """Find a submodule by the repo its url points to (see url_key)"""
+        key = url_key(url)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT name, path, url, sha, branch FROM submodules "
+                "WHERE repo = ?",
+                (self.repo,),
+            ).fetchall()
+        for row in rows:
+            if url_key(row[2]) == key:
+                return Submodule(*row)
+        return None
@@ -0,0 +1,34 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from typing import TYPE_CHECKING, Dict
+
+from msk.lazy import InstanceLazy
+
+if TYPE_CHECKING:
+    from msm import MycroftSkillsManager, SkillEntry
+
+
+class SkillIndex:
+    """Lookup of the SkillEntry objects of an msm by name"""
+
+    def __init__(self, msm: "MycroftSkillsManager"):
+        self.msm = msm
+
+    by_name = InstanceLazy(
+        lambda s: {skill.name: skill for skill in s.msm.all_skills}
+    )  # type: Dict[str, SkillEntry]
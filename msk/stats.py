@@ -0,0 +1,155 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Aggregated timings of msk runs
+
+Every run appends one JSON line with the duration of the action and its
+phases (including time spent waiting for locks and for the GitHub rate
+limit) along with the number of git commands and GitHub requests made.
+"""
+
+import json
+import os
+import time
+from math import ceil
+from os.path import join
+from typing import Dict, Iterator, List, Optional
+
+from msk.trace import listeners
+from msk.util import tokendir
+
+statsfile = join(tokendir, "stats.jsonl")
+quantiles = [0.5, 0.95, 0.99]
+
+
+class RunStats:
+    """Span listener summing up a single run"""
+
+    def __init__(self, action: str):
+        self.action = action
+        self.duration = 0.0
+        self.phases = {}  # type: Dict[str, float]
+        self.counts = {"git": 0, "github": 0}
+
+    def __call__(
+        self, name: str, category: str, begin: float, end: float, args: dict
+    ):
+        if category == "action":
+            self.duration += end - begin
+        elif category in ("phase", "lock", "rate limit"):
+            self.phases[name] = self.phases.get(name, 0.0) + end - begin
+        elif category in self.counts:
+            self.counts[category] += 1
+
+    def start(self):
+        listeners.append(self)
+
+    def stop(self):
+        from msk.locking import file_lock
+
+        listeners.remove(self)
+        os.makedirs(tokendir, exist_ok=True)
+        line = json.dumps(self.to_dict(), separators=(",", ":")) + "\n"
+        with file_lock(statsfile, "stats"), open(statsfile, "a") as f:
+            f.write(line)
+
+    def to_dict(self) -> dict:
+        return {
+            "time": round(time.time()),
+            "action": self.action,
+            "duration": round(self.duration, 4),
+            "phases": {k: round(v, 4) for k, v in self.phases.items()},
+            "git": self.counts["git"],
+            "github": self.counts["github"],
+        }
+
+
+def load_runs(filename: str = statsfile) -> Iterator[dict]:
+    try:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass  # Partially written line
+    except FileNotFoundError:
+        return
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest rank percentile"""
+    return sorted_values[max(0, ceil(q * len(sorted_values)) - 1)]
+
+
+def expected_requests(action: str, recent: int = 50) -> Optional[int]:
+    """GitHub requests of the action in 95% of its recent runs"""
+    counts = [run["github"] for run in load_runs() if run["action"] == action]
+    if not counts:
+        return None
+    return int(percentile(sorted(counts[-recent:]), 0.95))
+
+
+def collect_samples(runs) -> Dict[str, Dict[str, List[float]]]:
+    """Group the values of all runs by metric and label"""
+    samples = {"duration": {}, "phase": {}, "git": {}, "github": {}}
+    for run in runs:
+        action = run["action"]
+        samples["duration"].setdefault(action, []).append(run["duration"])
+        samples["git"].setdefault(action, []).append(run["git"])
+        samples["github"].setdefault(action, []).append(run["github"])
+        for phase, duration in run["phases"].items():
+            samples["phase"].setdefault(phase, []).append(duration)
+    for by_label in samples.values():
+        for values in by_label.values():
+            values.sort()
+    return samples
+
+
+openmetrics_names = {
+    "duration": ("msk_action_duration_seconds", "action", "seconds"),
+    "phase": ("msk_phase_duration_seconds", "phase", "seconds"),
+    "git": ("msk_git_commands", "action", None),
+    "github": ("msk_github_requests", "action", None),
+}
+
+
+def to_openmetrics(samples) -> str:
+    lines = []
+    for metric, by_label in samples.items():
+        name, label, unit = openmetrics_names[metric]
+        lines.append("# TYPE {} summary".format(name))
+        if unit:
+            lines.append("# UNIT {} {}".format(name, unit))
+        for value, values in sorted(by_label.items()):
+            for q in quantiles:
+                lines.append(
+                    '{}{{{}="{}",quantile="{}"}} {}'.format(
+                        name, label, value, q, percentile(values, q)
+                    )
+                )
+            lines.append(
+                '{}_sum{{{}="{}"}} {}'.format(
+                    name, label, value, round(sum(values), 4)
+                )
+            )
+            lines.append(
+                '{}_count{{{}="{}"}} {}'.format(
+                    name, label, value, len(values)
+                )
+            )
+    lines.append("# EOF")
+    return "\n".join(lines)
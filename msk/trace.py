@@ -0,0 +1,155 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Span recording used by msk --trace and msk stats
+
+Code wraps interesting work in span(). The spans are passed to every
+registered listener; with none registered span() does nothing. The
+Tracer listener writes Chrome trace event JSON which can be opened in
+Perfetto (ui.perfetto.dev) or chrome://tracing.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Callables receiving (name, category, begin, end, args) for each span
+listeners = []
+tracer = None
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+
+    def __call__(
+        self, name: str, category: str, begin: float, end: float, args: dict
+    ):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (begin - self.start) * 1e6,
+            "dur": (end - begin) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def save(self, filename: str):
+        import json
+
+        threads = {event["tid"] for event in self.events}
+        names = {t.ident: t.name for t in threading.enumerate()}
+        metadata = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "args": {"name": "msk"},
+            }
+        ] + [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": tid,
+                "args": {"name": names.get(tid, str(tid))},
+            }
+            for tid in threads
+        ]
+        trace = {
+            "traceEvents": metadata + self.events,
+            "displayTimeUnit": "ms",
+        }
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+
+@contextmanager
+def span(name: str, category: str, **args):
+    """Report the time spent in the block to the listeners
+
+    Yields the args dict of the span so the block can add results to it.
+    """
+    if not listeners:
+        yield args
+        return
+    begin = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        for listener in listeners:
+            listener(name, category, begin, end, args)
+
+
+def traced(name: str, category: str = "phase"):
+    """Decorator wrapping every call of the function in a span"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def traced_git_execute(execute):
+    @wraps(execute)
+    def wrapper(self, command, *args, **kwargs):
+        name = " ".join(command[:2]) if isinstance(command, list) else command
+        with span(name, "git", command=command, cwd=self._working_dir):
+            return execute(self, command, *args, **kwargs)
+
+    wrapper.traced = True
+    return wrapper
+
+
+def instrument_git():
+    """Report every GitPython command as a span"""
+    from git.cmd import Git
+
+    if not getattr(Git.execute, "traced", False):
+        Git.execute = traced_git_execute(Git.execute)
+
+
+def start_tracing():
+    """Start recording spans for a Chrome trace"""
+    global tracer
+    tracer = Tracer()
+    listeners.append(tracer)
+    instrument_git()
+
+
+def stop_tracing(filename: str):
+    """Write the recorded spans to filename as Chrome trace event JSON"""
+    global tracer
+    if tracer:
+        listeners.remove(tracer)
+        tracer.save(filename)
+        tracer = None
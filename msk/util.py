@@ -17,28 +17,44 @@
 #
 import atexit
 
+import json
 import os
+import re
+import time
 from configparser import NoOptionError
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
 from difflib import SequenceMatcher
 from functools import wraps
-from git.config import GitConfigParser, get_config_path
-from github import Github, GithubException
-from github.Repository import Repository
-from msm import SkillEntry
 from os import chmod
 from os.path import join, dirname
 from tempfile import mkstemp
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from glob import glob
 from pathlib import Path
 
 from msk import __version__
-from msk.exceptions import PRModified, MskException, SkillNameTaken
+from msk.trace import span, traced
+
+# GitPython, PyGithub and msm are imported where they are used so that
+# commands which never touch them (msk --help, msk create-test) start fast
+if TYPE_CHECKING:
+    from github import Github
+    from github.Repository import Repository
+
+# Environment variable holding the token for the git processes msk starts
+TOKEN_ENV = "MSK_GITHUB_TOKEN"
+
+# Credential helper answering git's "get" requests from TOKEN_ENV. Being a
+# shell function, git only forks sh instead of a Python interpreter.
+GIT_CREDENTIAL_HELPER = (
+    '!f() {{ test "$1" = get && echo username=x-access-token && '
+    'echo "password=${}"; }}; f'.format(TOKEN_ENV)
+)
 
-ASKPASS = '''#!/usr/bin/env python3
-print(r"""{token}""")
-'''
+# Fallback for git older than 2.31, which ignores GIT_CONFIG_COUNT
+ASKPASS = '''#!/bin/sh
+echo "${}"
+'''.format(TOKEN_ENV)
 
 skills_kit_footer = (
     "<sub>Created with [mycroft-skills-kit]({}) v{}</sub>".format(
@@ -48,27 +64,50 @@ skills_kit_footer = (
 
 tokendir = str(Path.home()) + "/.mycroft/msk/"
 tokenfile = tokendir + "GITHUB_TOKEN"
+tokeninfofile = tokendir + "GITHUB_TOKEN.json"
+
+# Seconds a successful token validation is trusted before asking GitHub again
+token_ttl = int(os.environ.get("MSK_GITHUB_TOKEN_TTL", 24 * 60 * 60))
 
 
 def register_git_injector(token):
-    """Generate a script that writes the token to the git command line tool"""
+    """Make the token available to the git commands run by msk
+
+    The token is only passed through the environment. A credential helper
+    for github.com is added to the configuration of git processes started
+    by msk (not to any config file) which reads it from there.
+    """
+    os.environ[TOKEN_ENV] = token.strip()
+
+    index = int(os.environ.get("GIT_CONFIG_COUNT", 0))
+    os.environ["GIT_CONFIG_KEY_{}".format(index)] = (
+        "credential.https://github.com.helper"
+    )
+    os.environ["GIT_CONFIG_VALUE_{}".format(index)] = GIT_CREDENTIAL_HELPER
+    os.environ["GIT_CONFIG_COUNT"] = str(index + 1)
+
     fd, tmp_path = mkstemp()
     atexit.register(lambda: os.remove(tmp_path))
 
     with os.fdopen(fd, "w") as f:
-        f.write(ASKPASS.format(token=token.replace('"""', r"\"\"\"").strip()))
+        f.write(ASKPASS)
 
     chmod(tmp_path, 0o700)
     os.environ["GIT_ASKPASS"] = tmp_path
 
 
-def ask_for_github_token() -> Github:
+def ask_for_github_token() -> "Github":
     """Ask for GitHub Token if there isnt stored token
     or stored token is invalid"""
+    from github import Github
+    from msk.github_cache import enable_cache
+    from msk.rate_limit import start_scheduler
+
     print("")
     token = get_stored_github_token()
-    if token and check_token(token):
-        github = Github(token)
+    if token:
+        github = enable_cache(Github(token))
+        start_scheduler(token)
         register_git_injector(token)
         return github
     else:
@@ -92,9 +131,12 @@ def ask_for_github_token() -> Github:
                 print("")
                 retry = True
             token = input("Personal Access Token: ")
-            if check_token(token):
-                github = Github(token)
-                store_github_token(token)
+            info = check_token(token)
+            if info:
+                github = enable_cache(Github(token))
+                if store_github_token(token):
+                    store_token_info(token, info)
+                start_scheduler(token)
                 register_git_injector(token)
                 return github
             else:
@@ -108,32 +150,102 @@ def ask_for_github_token() -> Github:
                 print("")
 
 
-def check_token(token):
-    """Check if at GitHub Token has 'repo' in the scope"""
+@traced("token validation")
+def check_token(token) -> Optional[dict]:
+    """Check if at GitHub Token has 'repo' in the scope
+
+    Returns the validated login and scopes, or None if the token can't be
+    used.
+    """
+    from github import Github
+
     github = Github(token)
     try:
-        _ = github.get_user().login
-        _ = github.oauth_scopes
-        if "repo" in github.oauth_scopes:
-            return True
-        else:
-            return False
+        login = github.get_user().login
+        # Filled in from the headers of the request above
+        scopes = github.oauth_scopes or []
     except Exception:
-        return False
+        return None
+    if "repo" not in scopes:
+        return None
+    return {"login": login, "scopes": scopes, "validated_at": time.time()}
+
+
+def hash_token(token: str) -> str:
+    from hashlib import sha256
+
+    return sha256(token.strip().encode()).hexdigest()
+
+
+def load_token_info(token) -> Optional[dict]:
+    """Return the cached validation of the token if it is recent enough"""
+    try:
+        with open(tokeninfofile) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get("token_hash") != hash_token(token):
+        return None
+    if time.time() - info.get("validated_at", 0) > token_ttl:
+        return None
+    return info
+
+
+def token_lock():
+    """Lock held while reading or changing the stored token"""
+    from msk.locking import file_lock
+
+    return file_lock(tokenfile, "token")
+
+
+def store_token_info(token, info: dict):
+    """Save the validation of the stored token next to it"""
+    from msk.locking import atomic_write
+
+    with token_lock(), atomic_write(tokeninfofile) as f:
+        json.dump(dict(info, token_hash=hash_token(token)), f)
+
+
+def forget_token_info():
+    with token_lock(), suppress(FileNotFoundError):
+        os.remove(tokeninfofile)
 
 
 def get_stored_github_token():
     """Returns stored GitHub token or false if there isnt
     one or the token is invalid"""
-    if os.path.isfile(tokenfile):
+    # Held during validation so concurrent runs validate the token once
+    with token_lock():
+        if not os.path.isfile(tokenfile):
+            return False
         with open(tokenfile, "r") as f:
             token = f.readline()
-        if not check_token(token):
+        if load_token_info(token):
+            return token
+        info = check_token(token)
+        if not info:
             os.remove(tokenfile)
+            forget_token_info()
         else:
+            store_token_info(token, info)
             return token
-    else:
-        return False
+
+
+def get_github_login(github: "Github") -> str:
+    """Login of the token owner, from the cached validation if possible"""
+    info = load_token_info(os.environ.get(TOKEN_ENV, ""))
+    return info["login"] if info else github.get_user().login
+
+
+def revalidate_github_token():
+    """Validate the stored token again after GitHub rejected it
+
+    Returns the token if it is still valid. Otherwise it is removed so the
+    next run asks for a new one.
+    """
+    with token_lock():
+        forget_token_info()
+        return get_stored_github_token()
 
 
 def store_github_token(token):
@@ -143,19 +255,22 @@ def store_github_token(token):
         "Do you want msk to store the GitHub Personal Access Token? (Y/n)",
         True,
     ):
-        if not os.path.exists(tokendir):
-            os.makedirs(tokendir)
-        with open(tokenfile, "w") as f:
+        from msk.locking import atomic_write
+
+        with token_lock(), atomic_write(tokenfile) as f:
             f.write(token)
-            os.chmod(tokenfile, 0o600)
         print("Your GitHub Personal Access Token is stored in " + tokenfile)
         print("")
+        return True
     else:
         print("Remember to store your token in a safe place.")
         print("")
+        return False
 
 
 def skill_repo_name(url: str):
+    from msm import SkillEntry
+
     return "{}/{}".format(
         SkillEntry.extract_author(url), SkillEntry.extract_repo_name(url)
     )
@@ -163,7 +278,8 @@ def skill_repo_name(url: str):
 
 def ask_input(message: str, validator=lambda x: True, on_fail="Invalid entry"):
     while True:
-        resp = input(message + " ").strip()
+        with span("ask_input", "prompt", message=message):
+            resp = input(message + " ").strip()
         try:
             if validator(resp):
                 return resp
@@ -182,6 +298,8 @@ def ask_choice(
             print(on_empty)
             return None
         else:
+            from msk.exceptions import MskException
+
             raise MskException(on_empty or 'Error with "{}"'.format(message))
 
     print()
@@ -231,17 +349,27 @@ def ask_yes_no(message: str, default: Optional[bool]) -> bool:
     return {"n": False, "y": True, "": default}[resp.lower()]
 
 
+@traced("pr creation")
 def create_or_edit_pr(
     title: str,
     body: str,
-    skills_repo: Repository,
-    user,
+    skills_repo: "Repository",
+    login: str,
     branch: str,
     repo_branch: str,
+    pulls: list = None,
 ):
+    """Open a PR of the branch, or update the one already open
+
+    pulls are the open PRs of the branch if they were already looked up.
+    """
+    from github import GithubException
+    from msk.exceptions import PRModified, SkillNameTaken
+
     base = repo_branch
-    head = "{}:{}".format(user.login, branch)
-    pulls = list(skills_repo.get_pulls(base=base, head=head))
+    head = "{}:{}".format(login, branch)
+    if pulls is None:
+        pulls = list(skills_repo.get_pulls(base=base, head=head))
     if pulls:
         pull = pulls[0]
         if "mycroft-skills-kit" in pull.body:
@@ -292,6 +420,36 @@ def read_lines(*path):
         return [i for i in (i.strip() for i in f.readlines()) if i]
 
 
+class MarkdownSections:
+    """Index of the "# Header" sections of a Markdown document
+
+    The text is scanned once to record where each section starts and ends.
+    Section contents are only sliced out when asked for. Names are the
+    lowercase header text without the leading #s.
+    """
+
+    header_pattern = re.compile(r"^[ \t]*#.*$", re.MULTILINE)
+
+    def __init__(self, text: str):
+        self.text = text
+        self.offsets = {}
+        name, start = None, 0
+        for match in self.header_pattern.finditer(text):
+            if name is not None:
+                self.offsets[name] = (start, match.start())
+            name = match.group().strip().strip("# ").lower()
+            start = match.end()
+        if name is not None:
+            self.offsets[name] = (start, len(text))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.offsets
+
+    def __getitem__(self, name: str) -> str:
+        start, end = self.offsets[name]
+        return self.text[start:end]
+
+
 def serialized(func):
     """Write a serializer by yielding each line of output"""
 
@@ -335,8 +493,13 @@ and
 
 def ensure_git_user():
     """Prompt for fullname and email if git config is missing it."""
+    from git.config import GitConfigParser, get_config_path
+    from msk.locking import file_lock
+
     conf_path = get_config_path("global")
-    with GitConfigParser(conf_path, read_only=False) as conf_parser:
+    with file_lock(conf_path, "git config"), GitConfigParser(
+        conf_path, read_only=False
+    ) as conf_parser:
 
         # Make sure a user section exists
         if "user" not in conf_parser.sections():
@@ -0,0 +1,125 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Count the processes git starts to authenticate a push to GitHub
+
+Every authenticated push asks for credentials once ("git credential
+fill") and reports them as working afterwards ("git credential
+approve"). This runs both steps repeatedly, once with the Python
+GIT_ASKPASS script msk used to write and once with the credential helper
+set up by msk.util.register_git_injector, and reports the child processes
+git started for each step (from its trace2 events) and the time taken per
+push.
+
+    python scripts/bench_git_credentials.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import join
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, join(os.path.dirname(__file__), ".."))
+
+from msk.util import register_git_injector  # noqa: E402
+
+token = "0123456789abcdef0123456789abcdef01234567"
+credential = "protocol=https\nhost=github.com\n"
+
+python_askpass = '''#!/usr/bin/env python3
+print(r"""{token}""")
+'''
+
+
+def credential_round(env: dict, fill_trace: str, approve_trace: str):
+    """Authenticate one push: fill, then approve the returned credential"""
+    filled = subprocess.run(
+        ["git", "credential", "fill"],
+        input=credential + "\n",
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(env, GIT_TRACE2_EVENT=fill_trace),
+        check=True,
+    ).stdout
+    if token not in filled:
+        raise RuntimeError("git did not receive the token")
+    subprocess.run(
+        ["git", "credential", "approve"],
+        input=filled + "\n",
+        universal_newlines=True,
+        env=dict(env, GIT_TRACE2_EVENT=approve_trace),
+        check=True,
+    )
+
+
+def count_children(trace: str) -> int:
+    with open(trace) as f:
+        return sum(json.loads(line)["event"] == "child_start" for line in f)
+
+
+def measure(env: dict, runs: int, folder: str) -> tuple:
+    """Average processes per fill and approve, and milliseconds per push"""
+    traces = [join(folder, "fill.json"), join(folder, "approve.json")]
+    fills = approves = 0
+    begin = time.perf_counter()
+    for _ in range(runs):
+        for trace in traces:
+            open(trace, "w").close()
+        credential_round(env, *traces)
+        fills += count_children(traces[0])
+        approves += count_children(traces[1])
+    per_push = (time.perf_counter() - begin) / runs
+    return fills / runs, approves / runs, per_push * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with TemporaryDirectory() as folder:
+        # Leave out the user's own credential helpers
+        base = dict(
+            os.environ,
+            HOME=folder,
+            XDG_CONFIG_HOME=folder,
+            GIT_CONFIG_NOSYSTEM="1",
+            GIT_TERMINAL_PROMPT="0",
+        )
+        for key in [k for k in base if k.startswith("GIT_CONFIG_")]:
+            if key != "GIT_CONFIG_NOSYSTEM":
+                del base[key]
+
+        askpass = join(folder, "askpass.py")
+        with open(askpass, "w") as f:
+            f.write(python_askpass.format(token=token))
+        os.chmod(askpass, 0o700)
+        before = measure(dict(base, GIT_ASKPASS=askpass), runs, folder)
+
+        os.environ.clear()
+        os.environ.update(base)
+        register_git_injector(token)
+        after = measure(dict(os.environ), runs, folder)
+
+    line = "  {:<18} {:.1f} on fill, {:.1f} on approve, {:.1f}ms per push"
+    print("Processes started by git over {} pushes:".format(runs))
+    print(line.format("python askpass:", *before))
+    print(line.format("credential helper:", *after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Check github_async.AsyncGithub against a local stand-in for GitHub
+
+Starts an HTTP server answering the REST endpoints AsyncGithub uses and
+checks that requests run concurrently up to max_concurrency over reused
+connections, that errors raise the PyGithub exceptions and that
+create_or_edit_pr and set_branch take the right paths.
+
+    python scripts/check_github_async.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os.path import join
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, join(os.path.dirname(__file__), ".."))
+
+from github import (  # noqa: E402
+    BadCredentialsException,
+    UnknownObjectException,
+)
+
+from msk.exceptions import PRModified  # noqa: E402
+from github_async import AsyncGithub, create_or_edit_pr  # noqa: E402
+
+token = "stand-in-token"
+max_concurrency = 4
+request_delay = 0.1
+
+
+class StandIn:
+    """Requests seen by the server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.clients = set()
+        self.requests = []
+        self.pulls = []
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        state = self.server.state
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            state.clients.add(self.client_address)
+            state.requests.append((self.command, self.path))
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or "null")
+            if self.headers.get("Authorization") != "token " + token:
+                return self.respond(401, {"message": "Bad credentials"})
+            time.sleep(request_delay)
+            self.respond(*self.route(state, data))
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def route(self, state: StandIn, data) -> tuple:
+        path = self.path.split("?")[0]
+        if self.command == "GET" and path.startswith("/repos/"):
+            if path.endswith("/pulls"):
+                return 200, state.pulls
+            name = path[len("/repos/"):]
+            if name.startswith("missing/"):
+                return 404, {"message": "Not Found"}
+            return 200, {"full_name": name}
+        if self.command == "POST" and path.endswith("/pulls"):
+            pull = dict(data, number=len(state.pulls) + 1)
+            state.pulls.append(pull)
+            return 201, pull
+        if self.command == "PATCH" and "/pulls/" in path:
+            pull = state.pulls[int(path.rsplit("/", 1)[1]) - 1]
+            pull.update(data)
+            return 200, pull
+        if self.command == "PATCH" and "/git/refs/heads/" in path:
+            return 422, {"message": "Reference does not exist"}
+        if self.command == "POST" and path.endswith("/git/refs"):
+            return 201, {"ref": data["ref"], "object": {"sha": data["sha"]}}
+        return 404, {"message": "Not Found"}
+
+    do_GET = do_POST = do_PATCH = handle_request
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise SystemExit("FAILED: " + message)
+    print("ok:", message)
+
+
+async def run_checks(base_url: str, state: StandIn):
+    async with AsyncGithub(token, base_url, max_concurrency) as github:
+        names = ["owner/repo-{}".format(i) for i in range(3 * max_concurrency)]
+        begin = time.perf_counter()
+        repos = await asyncio.gather(*(github.get_repo(n) for n in names))
+        duration = time.perf_counter() - begin
+        check(
+            [repo["full_name"] for repo in repos] == names,
+            "responses are returned in request order",
+        )
+        check(
+            state.max_in_flight == max_concurrency,
+            "{} requests in flight at most".format(state.max_in_flight),
+        )
+        check(
+            duration < len(names) * request_delay / 2,
+            "requests overlap ({:.2f}s for {})".format(duration, len(names)),
+        )
+        check(
+            len(state.clients) <= max_concurrency,
+            "{} connections reused".format(len(state.clients)),
+        )
+
+        try:
+            await github.get_repo("missing/repo")
+        except UnknownObjectException:
+            check(True, "404 raises UnknownObjectException")
+        else:
+            check(False, "404 raises UnknownObjectException")
+
+        pull = await create_or_edit_pr(
+            github,
+            "Add skill",
+            "Created with mycroft-skills-kit",
+            "MycroftAI/mycroft-skills",
+            "me",
+            "add-skill",
+            "21.02",
+        )
+        check(pull["number"] == 1, "a new PR is created")
+        pull = await create_or_edit_pr(
+            github,
+            "Add skill again",
+            "Created with mycroft-skills-kit",
+            "MycroftAI/mycroft-skills",
+            "me",
+            "add-skill",
+            "21.02",
+        )
+        check(
+            pull["number"] == 1 and pull["title"] == "Add skill again",
+            "an existing PR is edited",
+        )
+        state.pulls[0]["body"] = "Written by hand"
+        try:
+            await create_or_edit_pr(
+                github, "t", "b", "o/r", "me", "add-skill", "21.02"
+            )
+        except PRModified:
+            check(True, "a PR written by hand is left alone")
+        else:
+            check(False, "a PR written by hand is left alone")
+
+        ref = await github.set_branch("me/repo", "new-branch", "0" * 40)
+        check(
+            ref["ref"] == "refs/heads/new-branch"
+            and state.requests[-2][0] == "PATCH",
+            "set_branch creates a branch that doesn't exist",
+        )
+
+    async with AsyncGithub("wrong", base_url) as github:
+        try:
+            await github.get_user()
+        except BadCredentialsException:
+            check(True, "401 raises BadCredentialsException")
+        else:
+            check(False, "401 raises BadCredentialsException")
+
+
+def main():
+    server = ThreadingServer(("127.0.0.1", 0), Handler)
+    server.state = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    try:
+        asyncio.run(run_checks(base_url, server.state))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# Copyright (c) 2018 Mycroft AI, Inc.
+#
+# This file is part of Mycroft Skills Kit
+# (see https://github.com/MycroftAI/mycroft-skills-kit).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Asyncio client for the GitHub REST calls msk makes
+
+Not part of the msk package: the actions use PyGithub, which sends one
+blocking request at a time. This prototype, checked by
+check_github_async.py, shows how batch flows could have many requests in
+flight:
+
+    async with AsyncGithub(token) as github:
+        repos = await asyncio.gather(
+            *(github.get_repo(name) for name in names)
+        )
+
+Requests share one requests session whose keep-alive connection pool
+holds a connection per concurrent request. They run in worker threads,
+with at most max_concurrency in flight at once. Responses are plain JSON
+dicts. Errors raise the same exceptions PyGithub does, so callers can
+handle both alike. base_url can point at a local HTTP server standing in
+for GitHub.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+
+import requests
+from github import (
+    BadCredentialsException,
+    GithubException,
+    UnknownObjectException,
+)
+
+from msk.github_cache import CachingAdapter, ResponseCache
+
+api_url = "https://api.github.com"
+default_concurrency = 8
+request_timeout = 30
+
+
+def github_exception(response: requests.Response) -> GithubException:
+    try:
+        data = response.json()
+    except ValueError:
+        data = {"message": response.text}
+    cls = {
+        401: BadCredentialsException,
+        404: UnknownObjectException,
+    }.get(response.status_code, GithubException)
+    return cls(response.status_code, data, dict(response.headers))
+
+
+class AsyncGithub:
+    def __init__(
+        self,
+        token: str = None,
+        base_url: str = api_url,
+        max_concurrency: int = default_concurrency,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        self.session.headers["User-Agent"] = "mycroft-skills-kit"
+        if token:
+            self.session.headers["Authorization"] = "token " + token.strip()
+        self.session.mount(
+            self.base_url,
+            CachingAdapter(
+                cache,
+                pool_connections=1,
+                pool_maxsize=max_concurrency,
+            ),
+        )
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(
+            max_concurrency, thread_name_prefix="github"
+        )
+        # Before Python 3.10 it is bound to the loop current when created,
+        # so it is only created once requests are made from a loop
+        self.semaphore = None  # type: Optional[asyncio.Semaphore]
+
+    async def __aenter__(self) -> "AsyncGithub":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    async def request(self, method: str, path: str, params=None, data=None):
+        """Send a request and return its decoded JSON body"""
+        send = partial(
+            self.session.request,
+            method,
+            self.base_url + path,
+            params=params,
+            json=data,
+            timeout=request_timeout,
+        )
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, send
+            )
+        if response.status_code >= 400:
+            raise github_exception(response)
+        return response.json() if response.content else None
+
+    async def get_user(self) -> dict:
+        return await self.request("GET", "/user")
+
+    async def get_repo(self, full_name: str) -> dict:
+        return await self.request("GET", "/repos/" + full_name)
+
+    async def create_repo(self, name: str, description: str = "") -> dict:
+        return await self.request(
+            "POST",
+            "/user/repos",
+            data={"name": name, "description": description},
+        )
+
+    async def create_fork(self, full_name: str) -> dict:
+        return await self.request("POST", "/repos/{}/forks".format(full_name))
+
+    async def merge_upstream(self, full_name: str, branch: str) -> dict:
+        return await self.request(
+            "POST",
+            "/repos/{}/merge-upstream".format(full_name),
+            data={"branch": branch},
+        )
+
+    async def get_commit(self, full_name: str, sha: str) -> dict:
+        return await self.request(
+            "GET", "/repos/{}/commits/{}".format(full_name, sha)
+        )
+
+    async def get_branch(self, full_name: str, branch: str) -> dict:
+        return await self.request(
+            "GET", "/repos/{}/branches/{}".format(full_name, branch)
+        )
+
+    async def get_contents(self, full_name: str, path: str, ref: str) -> dict:
+        return await self.request(
+            "GET",
+            "/repos/{}/contents/{}".format(full_name, path),
+            params={"ref": ref},
+        )
+
+    async def create_tree(
+        self, full_name: str, tree: List[dict], base_tree: str
+    ) -> dict:
+        return await self.request(
+            "POST",
+            "/repos/{}/git/trees".format(full_name),
+            data={"tree": tree, "base_tree": base_tree},
+        )
+
+    async def create_commit(
+        self, full_name: str, message: str, tree: str, parents: List[str]
+    ) -> dict:
+        return await self.request(
+            "POST",
+            "/repos/{}/git/commits".format(full_name),
+            data={"message": message, "tree": tree, "parents": parents},
+        )
+
+    async def set_branch(self, full_name: str, branch: str, sha: str) -> dict:
+        """Point a branch to a commit, creating it if needed"""
+        try:
+            return await self.request(
+                "PATCH",
+                "/repos/{}/git/refs/heads/{}".format(full_name, branch),
+                data={"sha": sha, "force": True},
+            )
+        except GithubException as e:
+            if e.status != 422:  # Returned for missing refs
+                raise
+        return await self.request(
+            "POST",
+            "/repos/{}/git/refs".format(full_name),
+            data={"ref": "refs/heads/" + branch, "sha": sha},
+        )
+
+    async def get_pulls(
+        self, full_name: str, base: str, head: str, state: str = "open"
+    ) -> List[dict]:
+        return await self.request(
+            "GET",
+            "/repos/{}/pulls".format(full_name),
+            params={"base": base, "head": head, "state": state},
+        )
+
+    async def create_pull(
+        self, full_name: str, title: str, body: str, base: str, head: str
+    ) -> dict:
+        return await self.request(
+            "POST",
+            "/repos/{}/pulls".format(full_name),
+            data={"title": title, "body": body, "base": base, "head": head},
+        )
+
+    async def edit_pull(
+        self, full_name: str, number: int, title: str, body: str
+    ) -> dict:
+        return await self.request(
+            "PATCH",
+            "/repos/{}/pulls/{}".format(full_name, number),
+            data={"title": title, "body": body},
+        )
+
+
+async def create_or_edit_pr(
+    github: AsyncGithub,
+    title: str,
+    body: str,
+    skills_repo: str,
+    login: str,
+    branch: str,
+    repo_branch: str,
+) -> dict:
+    """Async version of msk.util.create_or_edit_pr"""
+    from msk.exceptions import PRModified, SkillNameTaken
+
+    head = "{}:{}".format(login, branch)
+    pulls = await github.get_pulls(skills_repo, base=repo_branch, head=head)
+    if pulls:
+        pull = pulls[0]
+        if "mycroft-skills-kit" not in (pull["body"] or ""):
+            raise PRModified(
+                "Not updating description since it was not autogenerated"
+            )
+        return await github.edit_pull(skills_repo, pull["number"], title, body)
+    try:
+        return await github.create_pull(
+            skills_repo, title, body, base=repo_branch, head=head
+        )
+    except GithubException as e:
+        if e.status == 422:
+            raise SkillNameTaken(title) from e
+        raise
@@ -29,8 +29,9 @@ setup(
     version='0.4.0',  # Also update in msk/__init__.py
     packages=['msk', 'msk.actions'],
     package_data={'msk': ['licenses/*']},
-    install_requires=['GitPython>=3.0.5', 'msm~=0.9.0', 'pygithub',
-                      'requests', 'colorama'],
+    python_requires='>=3.8',
+    install_requires=['GitPython>=3.0.5', 'msm~=0.9.0', 'pygithub>=2.6.0',
+                      'requests', 'colorama', 'fasteners'],
     url='https://github.com/MycroftAI/mycroft-skills-kit',
     license='Apache-2.0',
     author='Mycroft AI',
@@ -48,9 +49,7 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
 
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
     ]
 )